@@ -0,0 +1,259 @@
+import io
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+import asyncio
+import argparse
+import importlib
+import itertools
+import threading
+import contextlib
+import numpy as np
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(os.path.join(EXAMPLES_DIR, 'common'))
+from evaStandIn import EvaStandIn
+from evaKinematics import Kinematics
+from evaLockLease import LockLease
+
+# Module names defined by more than one example
+_SHARED_MODULES = ('main', 'evaUtilities', 'pickupPipeline', 'config', 'config.config_manager')
+# Planning modules of grid2grid, imported at every start, and the optional packages they must not load
+STARTUP_MODULES = ('evaUtilities', 'gridToolpaths', 'ikCache', 'multiRobot')
+_OPTIONAL_PACKAGES = ('matplotlib', 'progress')
+# Corners of the benchmarked grids example grid [m], 20 cm square, reachable by the nominal local kinematics model at
+# the example's height
+GRIDS_CORNERS = ((0.15, -0.1), (0.3, -0.1), (0.3, 0.1))
+
+
+def load_example(example, *modules):
+    """Imports modules of an example directory, isolated from the same-named modules of the other examples"""
+    path = os.path.join(EXAMPLES_DIR, example)
+    for name in _SHARED_MODULES:
+        sys.modules.pop(name, None)
+    sys.path.insert(0, path)
+    try:
+        return [importlib.import_module(module) for module in modules]
+    finally:
+        sys.path.remove(path)
+        for name in _SHARED_MODULES:
+            sys.modules.pop(name, None)
+
+
+def percentiles(samples):
+    """p50/p95/p99 of a list of durations [s], in [ms]"""
+    if not len(samples):
+        return {}
+    samples = 1000 * np.asarray(samples, dtype=np.float64)
+    return {'p{}_ms'.format(p): float(np.percentile(samples, p)) for p in (50, 95, 99)}
+
+
+class Recorder:
+    """Completion times of the units of work of a run (grid positions, toolpath runs, pickups): their rate is the
+    throughput of the run, and the intervals between them its per-unit latency"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stamps = []
+
+    def __call__(self):
+        self.stamps.append(time.perf_counter())
+
+    def report(self, units=None):
+        """units : number of units completed, when different from the number of calls (i.e. cycles per run)"""
+        elapsed = time.perf_counter() - self.start
+        units = len(self.stamps) if units is None else units
+        report = {'elapsed_s': elapsed, 'units': units, 'throughput_per_s': units / elapsed if elapsed else 0.0}
+        report.update(percentiles(np.diff([self.start] + self.stamps)))
+        return report
+
+
+@contextlib.contextmanager
+def _quiet():
+    # The examples print their progress to stdout and their progress bars to stderr
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def bench_grids(args):
+    """Grid2D + grids/main.py: IK of the whole grid, then a go-to to every position and back home"""
+    grid2d, grids_main = load_example('grids', 'grid2d', 'main')
+    results = []
+    for size in args.sizes:
+        grid = grid2d.Grid2D([grid2d.XYPoint(x, y) for x, y in GRIDS_CORNERS], rows=size, columns=size)
+        for backend in ('remote', 'local'):
+            eva = EvaStandIn(latency=args.latency, motion_duration=args.motion)
+            recorder = Recorder()
+            with _quiet():
+                # The 'local' backend plans offline: it takes no Eva
+                kinematics = Kinematics(None if backend == 'local' else eva, backend)
+                grids_main.run_grid(eva, kinematics, grid, action_duration=0, on_position=recorder)
+            results.append(dict(suite='grids', scenario='{0}x{0} {1} IK'.format(size, backend),
+                                unit='position', **recorder.report()))
+    return results
+
+
+def _grid2grid_config(config_manager, size):
+    config = config_manager.load_config(os.path.join(EXAMPLES_DIR, 'grid2grid', 'config', 'use_case_config.yaml'))
+    config['ik_cache']['enabled'] = False
+    pitch = 120 / max(size - 1, 1)  # both grids span 120 mm [mm]
+    for grid_iter, y0 in zip(config['grids']['names'], (50, -200)):
+        config['grids']['row'][grid_iter] = config['grids']['col'][grid_iter] = size
+        config['grids']['row_pitch'][grid_iter] = config['grids']['col_pitch'][grid_iter] = pitch
+        config['grids']['x0'][grid_iter] = 200
+        config['grids']['y0'][grid_iter] = y0
+        config['grids']['guess'][grid_iter] = [0, 0.5, -1.5, 0, -1, 0]
+    return config
+
+
+def bench_grid2grid(args):
+    """EvaGrids.get_grid_points() with each IK planning mode, then one pass of the grid2grid loop
+    with each toolpath mode"""
+    eva_utilities, g2g_main, config_manager = load_example('grid2grid', 'evaUtilities', 'main',
+                                                           'config.config_manager')
+    results = []
+    for size in args.sizes:
+        config = _grid2grid_config(config_manager, size)
+        slots = size * size
+        for backend, mode in (('remote', 'serial'), ('remote', 'concurrent'), ('local', 'serial')):
+            config['kinematics']['backend'] = backend
+            config['planning']['mode'] = mode
+            eva = EvaStandIn(latency=args.latency)
+            eva_grids = eva_utilities.EvaGrids(None if backend == 'local' else eva, config, show_plot=False)
+            start = time.perf_counter()
+            with _quiet():
+                joints = eva_grids.get_grid_points(config['grids']['names'], confirm=False)
+            elapsed = time.perf_counter() - start
+            results.append(dict(suite='grid2grid', scenario='{0}x{0} planning {1} {2}'.format(size, backend, mode),
+                                unit='IK request', elapsed_s=elapsed, units=len(eva_grids.ik_stats.latencies),
+                                throughput_per_s=len(eva_grids.ik_stats.latencies) / elapsed,
+                                **percentiles(eva_grids.ik_stats.latencies)))
+        cycles = g2g_main.build_cycles(config, joints)
+        for toolpath_mode, policy in itertools.product(('per_slot', 'compiled'), ('home', 'hover')):
+            config['transit'] = {'policy': policy}
+            toolpaths = g2g_main.compile_toolpaths({"version": 2, "default_max_speed": 0.1, "payload": 0},
+                                                   g2g_main.cycle_timeline(config), cycles, config['EVA']['home'],
+                                                   config['toolpath']['max_waypoints'],
+                                                   config['toolpath']['max_timeline'])
+            eva = EvaStandIn(latency=args.latency, motion_duration=args.motion)
+            recorder = Recorder()
+            # As in grid2grid/main.py, the lock is leased once for the whole loop
+            with _quiet(), LockLease(eva):
+                if toolpath_mode == 'compiled':
+                    g2g_main.run_compiled(eva, toolpaths, on_run=recorder, home=config['EVA']['home'])
+                else:
+                    g2g_main.run_per_slot(eva, config, cycles, on_run=recorder)
+            # Throughput in cycles; latency per toolpath run, which is a single cycle only in 'per_slot' mode
+            results.append(dict(suite='grid2grid',
+                                scenario='{0}x{0} loop {1} transit {2}'.format(size, toolpath_mode, policy),
+                                unit='cycle', runs=len(recorder.stamps), **recorder.report(slots)))
+    return results
+
+
+def _camera_frame(index):
+    # Object 'C' detected with full score at a position that changes with every frame
+    return 'start,C,{:.1f},{:.1f},30,1,1,M,0,0,0,0,0,R,0,0,0,0,0,end'.format(index % 50, (index * 7) % 50).encode()
+
+
+def bench_vision(args):
+    """The vision pickup loop (serial and asyncio pipeline) fed by a simulated camera at several frame rates"""
+    eva_utilities, pipeline, vision_main, config_manager = load_example(
+        'machine_vision_object_pickup', 'evaUtilities', 'pickupPipeline', 'main', 'config.config_manager')
+    config = config_manager.load_config(
+        os.path.join(EXAMPLES_DIR, 'machine_vision_object_pickup', 'config', 'use_case_config.yaml'))
+    objects = config['objects']['names']
+    # Every simulated frame reports a new object: do not skip the ones close to the previous pickups
+    config['duplicates'] = {'window': 0}
+    results = []
+    for fps in args.fps:
+        for mode in ('serial', 'async'):
+            camera, camera_server = socket.socketpair()
+
+            def stream_frames():
+                for index in range(args.frames):
+                    camera_server.sendall(_camera_frame(index))
+                    time.sleep(1 / fps)
+                camera_server.close()
+
+            eva = EvaStandIn(latency=args.latency, motion_duration=args.motion)
+            toolpath = vision_main.build_toolpath(config['waypoints']['joints_home'], config['waypoints']['joints_drop'])
+            recorder = Recorder()
+            sender = threading.Thread(target=stream_frames)
+            sender.start()
+            with _quiet(), LockLease(eva):
+                planner = pipeline.PickupPlanner(eva, config)
+                camera_stream = eva_utilities.CameraStream(camera)
+                if mode == 'async':
+                    asyncio.run(pipeline.run_async(eva, camera_stream, objects, planner, toolpath, 2, recorder))
+                else:
+                    pipeline.run_serial(eva, camera_stream, objects, planner, toolpath, recorder)
+            sender.join()
+            camera.close()
+            results.append(dict(suite='vision', scenario='{} fps {}'.format(fps, mode), unit='pickup',
+                                frames=args.frames, **recorder.report()))
+    return results
+
+
+def bench_startup(args):
+    """Import time of the grid2grid planning modules, each run in a fresh interpreter, against a fixed budget:
+    plotting and progress bars are optional and loaded on first use, so they must not be imported at start-up"""
+    script = ('import sys, time, json\n'
+              'start = time.perf_counter()\n'
+              'import {}\n'
+              'print(json.dumps([time.perf_counter() - start, [name for name in {!r} if name in sys.modules]]))'
+              ).format(', '.join(STARTUP_MODULES), _OPTIONAL_PACKAGES)
+    durations, loaded = [], set()
+    for _ in range(args.startup_runs):
+        output = subprocess.run([sys.executable, '-c', script], cwd=os.path.join(EXAMPLES_DIR, 'grid2grid'),
+                                check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        duration, optional = json.loads(output)
+        durations.append(duration)
+        loaded.update(optional)
+    result = dict(suite='startup', scenario='grid2grid planning import', unit='import', elapsed_s=sum(durations),
+                  units=len(durations), throughput_per_s=len(durations) / sum(durations), budget_s=args.startup_budget,
+                  optional_loaded=sorted(loaded), **percentiles(durations))
+    result['within_budget'] = bool(np.median(durations) <= args.startup_budget) and not loaded
+    if not result['within_budget']:
+        print('Start-up over budget: median import {:.3f} s (budget {:.3f} s), optional packages loaded: {}'.format(
+            np.median(durations), args.startup_budget, sorted(loaded) or 'none'), file=sys.stderr)
+    return [result]
+
+
+SUITES = {'grids': bench_grids, 'grid2grid': bench_grid2grid, 'vision': bench_vision, 'startup': bench_startup}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Planning and cycle-time benchmarks of the examples, run against '
+                                                 'an in-process Eva stand-in')
+    parser.add_argument('--suites', nargs='+', choices=sorted(SUITES), default=sorted(SUITES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[4, 10], help='grid sizes (rows = columns) [#]')
+    parser.add_argument('--fps', nargs='+', type=float, default=[5, 20], help='camera frame rates [Hz]')
+    parser.add_argument('--frames', type=int, default=40, help='camera frames per vision run [#]')
+    parser.add_argument('--latency', type=float, default=0.005, help='latency of each request to Eva [s]')
+    parser.add_argument('--motion', type=float, default=0.005, help='duration of each motion step [s]')
+    parser.add_argument('--startup-runs', type=int, default=5, help='fresh interpreters of the startup suite [#]')
+    parser.add_argument('--startup-budget', type=float, default=0.4,
+                        help='largest median import time of the grid2grid planning modules [s]')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    for suite in args.suites:
+        for result in SUITES[suite](args):
+            results.append(result)
+            print('{:<10} {:<32} {:>9.1f} {:<10}/s  p50 {:>8.2f} ms  p95 {:>8.2f} ms  p99 {:>8.2f} ms'.format(
+                result['suite'], result['scenario'], result['throughput_per_s'], result['unit'],
+                result.get('p50_ms', float('nan')), result.get('p95_ms', float('nan')),
+                result.get('p99_ms', float('nan'))))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    # Budget checks, i.e. of the startup suite, fail the run
+    if any(result.get('within_budget') is False for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
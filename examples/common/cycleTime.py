@@ -0,0 +1,123 @@
+import numpy as np
+from evaKinematics import EvaChain
+
+
+# Nominal dynamics of Eva, used when the configuration does not set them: maximum speed [rad/s] and acceleration
+# [rad/s^2] of each joint, and acceleration [m/s^2] and default maximum speed [m/s] of the tool in linear moves.
+# These values are nominal: calibrate them against the durations of a few toolpath runs before comparing layouts
+JOINT_SPEEDS = [2.0, 2.0, 2.0, 3.0, 3.0, 3.0]
+JOINT_ACCELERATIONS = [5.0, 5.0, 5.0, 8.0, 8.0, 8.0]
+LINEAR_ACCELERATION = 1.0
+LINEAR_SPEED = 0.25
+
+
+def wait_time(timeline):
+    """Total duration [s] of the time waits of a toolpath timeline, whose durations are in ms as on Eva"""
+    return sum(step['condition']['duration'] for step in timeline
+               if step['type'] == 'wait' and step['condition']['type'] == 'time') / 1000
+
+
+def _trapezoid(distance, speed, acceleration):
+    """Duration [s] of moves of the given distances with a trapezoidal (or triangular) speed profile"""
+    distance = np.abs(distance)
+    ramp = speed * speed / acceleration
+    return np.where(distance >= ramp, distance / speed + speed / acceleration,
+                    2 * np.sqrt(distance / acceleration))
+
+
+class CycleTimeEstimator:
+    """Estimates the execution time of Eva toolpaths without running them.
+    Joint-space moves last as long as their slowest joint, each joint following a trapezoidal speed profile at the
+    joint speeds scaled by the 'default_velocity' of the toolpath (older toolpaths, a fraction of the maximum
+    speeds); linear moves cover the straight line between their end points at 'default_max_speed' [m/s] (version 2
+    toolpaths), which also caps the tool speed of joint-space moves. Waits add their duration [ms]; I/O steps are
+    taken as instantaneous. The tool positions come from the local kinematic model of the arm (evaKinematics)"""
+    def __init__(self, joint_speeds=JOINT_SPEEDS, joint_accelerations=JOINT_ACCELERATIONS,
+                 linear_acceleration=LINEAR_ACCELERATION, linear_speed=LINEAR_SPEED, chain=None):
+        self.joint_speeds = np.asarray(joint_speeds, dtype=np.float64)
+        self.joint_accelerations = np.asarray(joint_accelerations, dtype=np.float64)
+        self.linear_acceleration = linear_acceleration
+        self.linear_speed = linear_speed
+        self.chain = EvaChain(chain)
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds an estimator from the optional 'cycle_time' entry of a use-case configuration"""
+        config = config.get('cycle_time', {})
+        return cls(config.get('joint_speeds', JOINT_SPEEDS), config.get('joint_accelerations', JOINT_ACCELERATIONS),
+                   config.get('linear_acceleration', LINEAR_ACCELERATION), config.get('linear_speed', LINEAR_SPEED),
+                   config.get('chain'))
+
+    def move_times(self, joints_from, joints_to, linear, metadata):
+        """Durations [s] of a batch of moves between the (N, 6) joints_from and joints_to [rad], linear (N,) telling
+        linear moves from joint-space ones, with the speed settings of the toolpath metadata"""
+        joints_from = np.asarray(joints_from, dtype=np.float64).reshape(-1, 6)
+        joints_to = np.asarray(joints_to, dtype=np.float64).reshape(-1, 6)
+        linear = np.asarray(linear, dtype=bool)
+        velocity = float(np.clip(metadata.get('default_velocity', 1.0), 1e-3, 1.0))
+        max_speed = metadata.get('default_max_speed')
+        # Synchronised joint-space move: every joint arrives with the slowest one
+        joint_time = _trapezoid(joints_to - joints_from, self.joint_speeds * velocity,
+                                self.joint_accelerations).max(axis=1)
+        positions, _ = self.chain.forward(np.concatenate([joints_from, joints_to]))
+        chord = np.linalg.norm(positions[len(joints_from):] - positions[:len(joints_from)], axis=1)
+        tool_speed = self.linear_speed if max_speed is None else max_speed
+        tool_time = _trapezoid(chord, tool_speed, self.linear_acceleration)
+        # Joint-space moves are only slowed down by the tool speed limit when the toolpath sets one
+        return np.where(linear | (max_speed is not None), np.maximum(joint_time, tool_time), joint_time)
+
+    def toolpath(self, toolpath, start=None):
+        """Estimated execution time [s] of a toolpath dictionary, i.e. of grid2grid or machine_vision_object_pickup.
+        start : joints [rad] of the arm when the toolpath is run, by default its home waypoint"""
+        joints = {waypoint['label_id'] - 1: waypoint['joints'] for waypoint in toolpath['waypoints']}
+        position = start
+        joints_from, joints_to, linear = [], [], []
+        wait = wait_time(toolpath['timeline'])
+        for step in toolpath['timeline']:
+            if step['type'] in ('home', 'trajectory'):
+                # The home step moves the arm from start to the home waypoint
+                target = joints[step['waypoint_id']]
+                joints_from.append(target if position is None else position)
+                joints_to.append(target)
+                linear.append(step.get('trajectory') == 'linear')
+                position = target
+        if not joints_from:
+            return wait
+        return wait + float(self.move_times(joints_from, joints_to, linear, toolpath['metadata']).sum())
+
+    def cycles(self, metadata, cycle_timeline, cycles, start):
+        """Estimated execution time [s] of each of a list of pick-and-place cycles, run one after the other from the
+        joints start [rad], all the cycles being estimated in one vectorized pass.
+        cycle_timeline : timeline of one cycle, whose trajectory steps reference waypoints by name with a 'waypoint'
+         key, as in grid2grid. Steps whose waypoint has no joints (i.e. unused operations) are skipped
+        cycles : list of dictionaries, one per cycle, mapping each waypoint name to its joints [rad]
+        Returns a (len(cycles),) array"""
+        if not cycles:
+            return np.zeros(0)
+        moves = [step for step in cycle_timeline
+                 if step['type'] == 'trajectory' and len(cycles[0][step['waypoint']])]
+        names = [step['waypoint'] for step in moves]
+        wait = wait_time(cycle_timeline)
+        if not names:
+            return np.full(len(cycles), wait)
+        # (cycles, steps, joints): waypoint reached by each step of each cycle, and the position before it
+        targets = np.array([[cycle[name] for name in names] for cycle in cycles], dtype=np.float64)
+        origins = np.empty_like(targets)
+        origins[:, 1:] = targets[:, :-1]
+        origins[0, 0] = start
+        origins[1:, 0] = targets[:-1, -1]
+        linear = np.array([step['trajectory'] == 'linear' for step in moves])
+        times = self.move_times(origins.reshape(-1, 6), targets.reshape(-1, 6), np.tile(linear, len(cycles)),
+                                metadata)
+        return times.reshape(len(cycles), len(names)).sum(axis=1) + wait
+
+    def pallet(self, metadata, cycle_timeline, cycles, home):
+        """Estimated execution time [s] of a whole pallet: its cycles, from home [rad], and the return home after
+        the last one if it does not end there. Returns the time of each cycle and the total time"""
+        times = self.cycles(metadata, cycle_timeline, cycles, home)
+        names = [step['waypoint'] for step in cycle_timeline
+                 if step['type'] == 'trajectory' and cycles and len(cycles[0][step['waypoint']])]
+        total = float(times.sum())
+        if names:
+            total += float(self.move_times(cycles[-1][names[-1]], home, [False], metadata)[0])
+        return times, total
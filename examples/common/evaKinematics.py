@@ -0,0 +1,234 @@
+import warnings
+from contextlib import nullcontext
+import numpy as np
+from evaLockLease import lock_session
+from poseMath import matrix_to_quaternion, quaternion_to_matrix, quaternion_to_axis_angle
+
+
+# Nominal kinematic chain of Eva with all joints at zero (arm upright), in the base frame [m]: rotation axis of
+# each joint, a point on each axis, and position of the tool-plate. These values are NOT Eva's calibrated
+# geometry: the 'local' backend is therefore for offline planning only, and joints sent to the arm are solved by
+# the 'checked' backend, which verifies them on Eva. Override them with the 'chain' entry of the kinematics
+# configuration
+NOMINAL_CHAIN = {
+    'axes': [[0, 0, 1], [0, 1, 0], [0, 1, 0], [0, 0, 1], [0, 1, 0], [0, 0, 1]],
+    'points': [[0, 0, 0], [0, 0, 0.187], [0, 0, 0.387], [0, 0, 0.387], [0, 0, 0.637], [0, 0, 0.637]],
+    'tool_plate': [0, 0, 0.737],
+}
+
+
+def _skew(v):
+    """(N, 3) vectors to (N, 3, 3) cross-product matrices"""
+    zero = np.zeros(v.shape[0])
+    return np.stack([np.stack([zero, -v[:, 2], v[:, 1]], axis=-1),
+                     np.stack([v[:, 2], zero, -v[:, 0]], axis=-1),
+                     np.stack([-v[:, 1], v[:, 0], zero], axis=-1)], axis=1)
+
+
+def _rotation_vector(rot):
+    """(N, 3, 3) rotation matrices to (N, 3) axis * angle vectors"""
+    axis, angle = quaternion_to_axis_angle(matrix_to_quaternion(rot))
+    return axis * angle[:, np.newaxis]
+
+
+class EvaChain:
+    """Product-of-exponentials model of Eva's 6-DoF chain, with forward kinematics, Jacobian and damped
+    least-squares inverse kinematics over arrays of poses"""
+    def __init__(self, chain=None):
+        chain = NOMINAL_CHAIN if chain is None else chain
+        self.axes = np.asarray(chain['axes'], dtype=np.float64)
+        self.axes /= np.linalg.norm(self.axes, axis=1, keepdims=True)
+        self.points = np.asarray(chain['points'], dtype=np.float64)
+        self.tool_plate = np.asarray(chain['tool_plate'], dtype=np.float64)
+
+    def _frames(self, joints):
+        """Rotation and translation of each joint's exponential, accumulated along the chain.
+        Returns the (N, 6, 3) joint axes and (N, 6, 3) axis points in the base frame at these joints,
+        and the (N, 3, 3) rotation and (N, 3) position of the tool-plate"""
+        n = joints.shape[0]
+        rot = np.broadcast_to(np.eye(3), (n, 3, 3)).copy()
+        pos = np.zeros((n, 3))
+        axes = np.empty((n, 6, 3))
+        points = np.empty((n, 6, 3))
+        for i in range(6):
+            # Axis of joint i, moved by the joints before it
+            axes[:, i] = rot @ self.axes[i]
+            points[:, i] = pos + rot @ self.points[i]
+            # Rodrigues: exp([w] q) = I + sin(q) [w] + (1 - cos(q)) [w]^2, translation (I - R_i) p_i
+            skew = _skew(np.broadcast_to(self.axes[i], (n, 3)))
+            theta = joints[:, i][:, np.newaxis, np.newaxis]
+            rot_i = np.eye(3) + np.sin(theta) * skew + (1 - np.cos(theta)) * (skew @ skew)
+            pos_i = self.points[i] - rot_i @ self.points[i]
+            pos = pos + (rot @ pos_i[..., np.newaxis])[..., 0]
+            rot = rot @ rot_i
+        return axes, points, rot, pos + rot @ self.tool_plate
+
+    def forward(self, joints):
+        """(N, 6) joints [rad] to (N, 3) tool-plate positions [m] and (N, 4) orientations [w, x, y, z]"""
+        joints = np.atleast_2d(np.asarray(joints, dtype=np.float64))
+        _, _, rot, pos = self._frames(joints)
+        return pos, matrix_to_quaternion(rot)
+
+    def inverse(self, guesses, positions, orientations, max_iterations=200, tol_position=1e-5,
+                tol_orientation=1e-4, damping=1e-3, max_step=0.5):
+        """Damped least-squares IK of N poses at once.
+        guesses : (N, 6) or (6,) initial joints [rad]
+        positions : (N, 3) target tool-plate positions [m]
+        orientations : (N, 4) or (4,) target orientations [w, x, y, z]
+        max_step : largest joint step of an iteration [rad], to stay on the branch of the guess
+        Returns the (N,) convergence flags, the (N, 6) joints [rad] and the (N,) iterations of each pose"""
+        positions = np.atleast_2d(np.asarray(positions, dtype=np.float64))
+        n = positions.shape[0]
+        joints = np.array(np.broadcast_to(np.asarray(guesses, dtype=np.float64), (n, 6)))
+        target_rot = quaternion_to_matrix(np.broadcast_to(np.asarray(orientations, dtype=np.float64), (n, 4)))
+        iterations = np.zeros(n, dtype=np.int64)
+        active = np.ones(n, dtype=bool)
+        for _ in range(max_iterations):
+            index = np.flatnonzero(active)
+            if index.size == 0:
+                break
+            axes, points, rot, pos = self._frames(joints[index])
+            error = np.concatenate([positions[index] - pos,
+                                    _rotation_vector(target_rot[index] @ np.transpose(rot, (0, 2, 1)))], axis=1)
+            done = ((np.linalg.norm(error[:, :3], axis=1) < tol_position) &
+                    (np.linalg.norm(error[:, 3:], axis=1) < tol_orientation))
+            active[index[done]] = False
+            index, error, axes, points, pos = index[~done], error[~done], axes[~done], points[~done], pos[~done]
+            if index.size == 0:
+                break
+            # Geometric Jacobian at the tool-plate: linear rows w x (p - q), angular rows w
+            jacobian = np.concatenate([np.cross(axes, pos[:, np.newaxis] - points), axes], axis=2).transpose(0, 2, 1)
+            jjt = jacobian @ jacobian.transpose(0, 2, 1) + damping ** 2 * np.eye(6)
+            step = (jacobian.transpose(0, 2, 1) @ np.linalg.solve(jjt, error[..., np.newaxis]))[..., 0]
+            step *= np.minimum(1.0, max_step / np.maximum(np.abs(step).max(axis=1), 1e-12))[:, np.newaxis]
+            joints[index] += step
+            iterations[index] += 1
+        # Wrap to [-pi, pi]
+        joints = (joints + np.pi) % (2 * np.pi) - np.pi
+        return ~active, joints, iterations
+
+
+class Kinematics:
+    """Forward and inverse kinematics with a selectable backend:
+    'remote' sends every request to Eva, as the Eva SDK does;
+    'local' solves them in NumPy with EvaChain, in batch and without a robot. Its joints are not verified, so it
+    is for offline planning only and does not take an Eva;
+    'checked' solves them locally and compares the first request, then one every check_every, with Eva's own
+    forward kinematics, switching to 'remote' if they disagree by more than tolerance [m] in position or
+    orientation_tolerance [rad] in orientation.
+    calc_forward_kinematics() and calc_inverse_kinematics() have the same arguments and results as the Eva SDK,
+    so a Kinematics can be passed in place of Eva to the helpers of the examples"""
+    BACKENDS = ('remote', 'local', 'checked')
+
+    def __init__(self, eva=None, backend='remote', chain=None, check_every=100, tolerance=1e-3,
+                 orientation_tolerance=1e-2):
+        if backend not in self.BACKENDS:
+            raise ValueError('Unknown kinematics backend {}, use one of {}'.format(backend, self.BACKENDS))
+        if backend != 'local' and eva is None:
+            raise ValueError('The {} kinematics backend needs an Eva'.format(backend))
+        if backend == 'local' and eva is not None:
+            raise ValueError("The 'local' kinematics backend is for offline planning only, its joints are not "
+                             "verified on Eva: use the 'checked' backend to move Eva")
+        self.eva = eva
+        self.backend = backend
+        self.chain = EvaChain(chain)
+        self.check_every = check_every
+        self.tolerance = tolerance
+        self.orientation_tolerance = orientation_tolerance
+        self.requests = 0
+        self.checks = 0
+        self.mismatches = 0
+
+    @classmethod
+    def from_config(cls, eva, config):
+        """Builds a Kinematics from the optional 'kinematics' entry of a use-case configuration"""
+        config = config.get('kinematics', {})
+        return cls(eva, config.get('backend', 'remote'), config.get('chain'), config.get('check_every', 100),
+                   config.get('tolerance', 1e-3), config.get('orientation_tolerance', 1e-2))
+
+    def lock(self):
+        """Eva's lock, or a session of its LockLease. Not needed by the local backend"""
+        if self.backend == 'local':
+            return nullcontext(self)
+        return lock_session(self.eva)
+
+    def _check_due(self, count):
+        if self.backend != 'checked':
+            return False
+        # The first request is always checked, before any local result is used
+        due = self.requests == 0 or self.requests // self.check_every != (self.requests + count) // self.check_every
+        self.requests += count
+        return due
+
+    def _check(self, joints, positions, orientations):
+        """Compares the local tool-plate poses of a batch of joints (N, 6), positions (N, 3) and orientations
+        (N, 4), with Eva's forward kinematics, for one pose every check_every and at least one, spread over the
+        batch. Returns False, after switching to the remote backend, if they disagree"""
+        count = joints.shape[0]
+        for index in np.unique(np.linspace(0, count - 1, max(1, count // self.check_every)).round().astype(int)):
+            self.checks += 1
+            remote = self.eva.calc_forward_kinematics(joints[index].tolist())
+            deviation = np.linalg.norm(np.array([remote['position'][k] for k in 'xyz']) - positions[index])
+            # Angle of the rotation between both orientations, q and -q being the same one
+            dot = abs(np.dot([remote['orientation'][k] for k in 'wxyz'], orientations[index]))
+            angle = 2 * np.arccos(min(dot, 1.0))
+            if deviation > self.tolerance or angle > self.orientation_tolerance:
+                self.mismatches += 1
+                self.backend = 'remote'
+                warnings.warn('Local kinematics deviates {:.4f} m and {:.4f} rad from Eva: switching to the remote '
+                              'backend. Check the kinematic chain parameters'.format(deviation, angle))
+                return False
+        return True
+
+    def forward(self, joints):
+        """Batched forward kinematics: (N, 6) joints [rad] to (N, 3) positions [m] and (N, 4) quaternions"""
+        joints = np.atleast_2d(np.asarray(joints, dtype=np.float64))
+        if self.backend == 'remote':
+            results = [self.eva.calc_forward_kinematics(list(q)) for q in joints.tolist()]
+            return (np.array([[r['position'][k] for k in 'xyz'] for r in results]),
+                    np.array([[r['orientation'][k] for k in 'wxyz'] for r in results]))
+        check = self._check_due(joints.shape[0])
+        positions, orientations = self.chain.forward(joints)
+        if check and not self._check(joints, positions, orientations):
+            # The local results of the batch are not trusted: Eva computes them again
+            return self.forward(joints)
+        return positions, orientations
+
+    def inverse(self, guesses, positions, orientations):
+        """Batched inverse kinematics of N poses. guesses (N, 6) or (6,) [rad], positions (N, 3) [m],
+        orientations (N, 4) or (4,) [w, x, y, z]. Returns (N,) success flags, (N, 6) joints and (N,) iterations"""
+        positions = np.atleast_2d(np.asarray(positions, dtype=np.float64))
+        if self.backend == 'remote':
+            n = positions.shape[0]
+            guesses = np.broadcast_to(np.asarray(guesses, dtype=np.float64), (n, 6)).tolist()
+            orientations = np.broadcast_to(np.asarray(orientations, dtype=np.float64), (n, 4)).tolist()
+            results = [self.eva.calc_inverse_kinematics(guess, dict(zip('xyz', pos)), dict(zip('wxyz', orient)))
+                       for guess, pos, orient in zip(guesses, positions.tolist(), orientations)]
+            return (np.array(['success' in r['ik']['result'] for r in results]),
+                    np.array([r['ik']['joints'] for r in results], dtype=np.float64),
+                    np.array([r['ik'].get('iterations', 0) for r in results]))
+        if not np.all(np.linalg.norm(np.asarray(orientations, dtype=np.float64), axis=-1) > 0):
+            raise ValueError('Invalid target orientation: null quaternion')
+        check = self._check_due(positions.shape[0])
+        success, joints, iterations = self.chain.inverse(guesses, positions, orientations)
+        targets = np.broadcast_to(np.asarray(orientations, dtype=np.float64), (positions.shape[0], 4))
+        targets = targets / np.linalg.norm(targets, axis=1, keepdims=True)
+        if check and success.any() and not self._check(joints[success], positions[success], targets[success]):
+            # The local solutions of the batch are not trusted: Eva solves them again
+            return self.inverse(guesses, positions, orientations)
+        return success, joints, iterations
+
+    def calc_forward_kinematics(self, joints, fk_type=None, tcp_config=None):
+        if self.backend == 'remote':
+            return self.eva.calc_forward_kinematics(joints)
+        positions, orientations = self.forward([joints])
+        return {'position': dict(zip('xyz', positions[0].tolist())),
+                'orientation': dict(zip('wxyz', orientations[0].tolist()))}
+
+    def calc_inverse_kinematics(self, guess, target_position, target_orientation, tolerance=None, perf=None):
+        if self.backend == 'remote':
+            return self.eva.calc_inverse_kinematics(guess, target_position, target_orientation)
+        success, joints, iterations = self.inverse(
+            guess, [[target_position[k] for k in 'xyz']], [[target_orientation[k] for k in 'wxyz']])
+        return {'ik': {'result': 'success' if success[0] else 'error', 'joints': joints[0].tolist(),
+                       'iterations': int(iterations[0])}}
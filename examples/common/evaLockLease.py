@@ -0,0 +1,97 @@
+import time
+import weakref
+import threading
+from contextlib import contextmanager
+
+
+# Lease registered for each robot, reused by lock_session()
+_leases = weakref.WeakKeyDictionary()
+
+
+class LockLease:
+    """Eva's lock, shared by all the operations of a program instead of being acquired and released around each of
+    them. The lock is acquired by the first session(), renewed in the background while it is held, and released
+    once no session has been open for idle_timeout seconds. Creating a LockLease registers it for its robot, so that
+    lock_session() reuses it"""
+    def __init__(self, eva, idle_timeout=5.0, renew_period=10.0, wait_timeout=None):
+        """idle_timeout : time without open sessions after which the lock is released [s]
+        renew_period : period of the lock renewals while the lock is held [s]
+        wait_timeout : longest wait for the lock, None to wait forever [s]"""
+        self.eva = eva
+        self.idle_timeout = idle_timeout
+        self.renew_period = renew_period
+        self.wait_timeout = wait_timeout
+        self.acquisitions = 0
+        self._held = False
+        self._sessions = 0
+        self._last_used = time.monotonic()
+        self._cond = threading.Condition()
+        _leases[eva] = self
+
+    @property
+    def held(self):
+        return self._held
+
+    @contextmanager
+    def session(self):
+        """Context in which Eva's lock is held, acquiring it if needed. Sessions can be nested and shared by threads"""
+        with self._cond:
+            if not self._held:
+                self.eva.lock_wait_for(timeout=self.wait_timeout)
+                self._held = True
+                self.acquisitions += 1
+                threading.Thread(target=self._maintain, daemon=True).start()
+            self._sessions += 1
+        try:
+            yield self.eva
+        finally:
+            with self._cond:
+                self._sessions -= 1
+                self._last_used = time.monotonic()
+                self._cond.notify_all()
+
+    def _maintain(self):
+        """Renews the lock while it is held, and releases it after idle_timeout without sessions"""
+        last_renew = time.monotonic()
+        with self._cond:
+            while self._held:
+                now = time.monotonic()
+                if self._sessions == 0 and now - self._last_used >= self.idle_timeout:
+                    self._release()
+                    return
+                if now - last_renew >= self.renew_period:
+                    try:
+                        self.eva.lock_renew()
+                    except Exception as e:
+                        # The lock is lost: the next session acquires it again
+                        print('Eva lock lease lost: {}'.format(e))
+                        self._held = False
+                        return
+                    last_renew = now
+                timeout = last_renew + self.renew_period - now
+                if self._sessions == 0:
+                    timeout = min(timeout, self._last_used + self.idle_timeout - now)
+                self._cond.wait(max(timeout, 0.0))
+
+    def _release(self):
+        self._held = False
+        self.eva.lock_unlock()
+        self._cond.notify_all()
+
+    def release(self):
+        """Releases the lock now, if it is held and no session is open"""
+        with self._cond:
+            if self._held and self._sessions == 0:
+                self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def lock_session(eva):
+    """Context in which Eva's lock is held: a session of the LockLease of eva if there is one, else eva.lock()"""
+    lease = _leases.get(eva)
+    return lease.session() if lease is not None else eva.lock()
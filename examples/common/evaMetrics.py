@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager, nullcontext, ExitStack
+
+
+# Shared no-op context of a disabled Metrics
+_NO_PHASE = nullcontext()
+
+
+class Histogram:
+    """Fixed-size histogram of durations [s] with logarithmic buckets, from 1 us to 1000 s with 20 buckets per
+    decade. Recording is a bisection and an increment; percentiles are estimated from the buckets,
+    within about 6% of the exact value"""
+    BOUNDS = [1e-6 * 10 ** (i / 20) for i in range(9 * 20 + 1)]  # upper bounds of the buckets [s]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """Estimated p-th percentile [s]: geometric centre of the bucket holding it, capped to the largest value"""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                break
+        if index == 0:
+            return min(self.BOUNDS[0], self.max)
+        if index == len(self.BOUNDS):
+            return self.max
+        return min((self.BOUNDS[index - 1] * self.BOUNDS[index]) ** 0.5, self.max)
+
+
+class Metrics:
+    """Per-phase durations (i.e. lock_wait, ik, upload, wait_ready, motion) and counters (i.e. picks) of a running
+    example, exported periodically as JSON lines or as a Prometheus text file.
+    A disabled Metrics records nothing: phase() returns a shared no-op context and count() returns at once"""
+    FORMATS = ('jsonl', 'prometheus')
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, enabled=True, export_file=None, export_format='jsonl', export_every=60.0):
+        """export_file : file the summaries are written to, None to only keep them in memory
+        export_format : 'jsonl' appends one JSON summary per line, 'prometheus' rewrites a text file in the
+         Prometheus exposition format (i.e. for the node_exporter textfile collector)
+        export_every : period of the exports [s], checked whenever a counter is incremented"""
+        if export_format not in self.FORMATS:
+            raise ValueError('Unknown metrics format {}, use one of {}'.format(export_format, self.FORMATS))
+        self.enabled = enabled
+        self.export_file = export_file
+        self.export_format = export_format
+        self.export_every = export_every
+        self.phases = {}
+        self.counters = {}
+        self.start = time.time()
+        self._last_export = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a Metrics from the optional 'metrics' entry of a use-case configuration"""
+        config = config.get('metrics', {})
+        return cls(config.get('enabled', False), config.get('file'), config.get('format', 'jsonl'),
+                   config.get('export_every', 60.0))
+
+    def record(self, phase, duration):
+        """Records the duration [s] of one occurrence of a phase"""
+        with self._lock:
+            if phase not in self.phases:
+                self.phases[phase] = Histogram()
+            self.phases[phase].record(duration)
+
+    @contextmanager
+    def _timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start)
+
+    def phase(self, name):
+        """Context manager timing a phase"""
+        if not self.enabled:
+            return _NO_PHASE
+        return self._timed(name)
+
+    def count(self, name, increment=1):
+        """Increments a counter, i.e. count('picks'), and exports a summary if one is due"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + increment
+        if self.export_file is not None and time.monotonic() - self._last_export >= self.export_every:
+            self.export()
+
+    def summary(self):
+        with self._lock:
+            uptime = time.time() - self.start
+            summary = {'time': time.time(), 'uptime_s': uptime, 'counters': dict(self.counters),
+                       'picks_per_hour': 3600 * self.counters.get('picks', 0) / uptime if uptime else 0.0,
+                       'phases': {}}
+            for name, histogram in self.phases.items():
+                phase = {'count': histogram.count, 'mean_ms': 1000 * histogram.sum / histogram.count,
+                         'max_ms': 1000 * histogram.max}
+                phase.update({'p{}_ms'.format(p): 1000 * histogram.percentile(p) for p in self.PERCENTILES})
+                summary['phases'][name] = phase
+            return summary
+
+    def export(self):
+        """Writes a summary to the export file"""
+        self._last_export = time.monotonic()
+        if not self.enabled or self.export_file is None:
+            return
+        summary = self.summary()
+        if self.export_format == 'jsonl':
+            with open(self.export_file, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+            return
+        lines = ['# TYPE eva_phase_seconds summary']
+        for name, phase in summary['phases'].items():
+            for p in self.PERCENTILES:
+                lines.append('eva_phase_seconds{{phase="{}",quantile="{}"}} {}'.format(
+                    name, p / 100, phase['p{}_ms'.format(p)] / 1000))
+            lines.append('eva_phase_seconds_sum{{phase="{}"}} {}'.format(name, self.phases[name].sum))
+            lines.append('eva_phase_seconds_count{{phase="{}"}} {}'.format(name, phase['count']))
+        lines.append('# TYPE eva_events_total counter')
+        for name, value in summary['counters'].items():
+            lines.append('eva_events_total{{event="{}"}} {}'.format(name, value))
+        lines.append('# TYPE eva_picks_per_hour gauge')
+        lines.append('eva_picks_per_hour {}'.format(summary['picks_per_hour']))
+        # Written to a temporary file first, so that the collector never reads a partial file
+        tmp_file = self.export_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_file, self.export_file)
+
+
+class InstrumentedEva:
+    """Proxy of an Eva that times its requests into a Metrics, by phase: lock_wait (acquisition of the lock, by
+    lock() or lock_wait_for()), ik, fk, upload (toolpaths_use), wait_ready (control_wait_for_ready) and motion
+    (control_run, control_go_to). Other attributes are passed through to Eva"""
+    PHASES = {'lock_wait_for': 'lock_wait', 'calc_inverse_kinematics': 'ik', 'calc_forward_kinematics': 'fk',
+              'toolpaths_use': 'upload', 'control_wait_for_ready': 'wait_ready', 'control_run': 'motion',
+              'control_go_to': 'motion'}
+
+    def __init__(self, eva, metrics):
+        self.eva = eva
+        self.metrics = metrics
+
+    @contextmanager
+    def lock(self, *args, **kwargs):
+        with ExitStack() as stack:
+            with self.metrics.phase('lock_wait'):
+                stack.enter_context(self.eva.lock(*args, **kwargs))
+            yield self
+
+    def __getattr__(self, name):
+        attribute = getattr(self.eva, name)
+        if name not in self.PHASES:
+            return attribute
+
+        def timed(*args, **kwargs):
+            with self.metrics.phase(self.PHASES[name]):
+                return attribute(*args, **kwargs)
+        return timed
+
+
+def instrument(eva, metrics):
+    """Eva, timed into metrics if they are enabled: a disabled Metrics adds no overhead to the requests"""
+    return InstrumentedEva(eva, metrics) if metrics.enabled else eva
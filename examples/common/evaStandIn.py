@@ -0,0 +1,127 @@
+import math
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+class EvaStandInError(Exception):
+    """Injected failure of an EvaStandIn request"""
+
+
+class EvaStandIn:
+    """In-process stand-in for the Eva SDK client, used to exercise and time the examples without a robot.
+    Every call sleeps for a configurable latency to emulate the HTTP round-trip to the arm, motions sleep for a
+    simulated duration, and call counters are kept so that lock churn and request concurrency can be checked"""
+    def __init__(self, latency=0.0, lock_latency=0.0, unreachable=None, iteration_latency=0.0, motion_duration=0.0,
+                 failures=None, seed=None):
+        """latency : duration of each request [s]
+        lock_latency : duration of each lock acquisition and release [s]
+        unreachable : optional predicate of the target position dict {'x', 'y', 'z'} [m], True when the IK must fail
+        iteration_latency : extra IK duration per solver iteration [s]. The number of iterations grows with the
+        distance between the guess and the solution, to emulate the effect of the seeding on a real solver
+        motion_duration : duration of each trajectory step of a toolpath run, and of each go-to [s]. Wait steps
+        and I/O steps take no time
+        failures : optional {request name: probability} of raising EvaStandInError, i.e. {'control_run': 0.01}
+        seed : seed of the failure injection, for reproducible runs"""
+        self.latency = latency
+        self.iteration_latency = iteration_latency
+        self.lock_latency = lock_latency
+        self.unreachable = unreachable
+        self.motion_duration = motion_duration
+        self.failures = dict(failures or {})
+        self.calls = {'lock': 0, 'lock_wait_for': 0, 'lock_renew': 0, 'lock_unlock': 0, 'calc_inverse_kinematics': 0,
+                      'calc_forward_kinematics': 0, 'toolpaths_use': 0, 'control_run': 0, 'control_go_to': 0,
+                      'control_wait_for_ready': 0}
+        self.toolpath = None
+        self._random = random.Random(seed)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock_owner = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.calls[name] += 1
+
+    @contextmanager
+    def _request(self, name, extra_latency=0.0):
+        self._count(name)
+        if self.failures.get(name) and self._random.random() < self.failures[name]:
+            raise EvaStandInError('Injected {} failure'.format(name))
+        with self._stats_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency + extra_latency)
+            yield
+        finally:
+            with self._stats_lock:
+                self.in_flight -= 1
+
+    @contextmanager
+    def lock(self, wait=True, timeout=None):
+        self._count('lock')
+        if not self._lock_owner.acquire(wait, -1 if timeout is None else timeout):
+            raise TimeoutError('Eva stand-in lock not available')
+        try:
+            time.sleep(self.lock_latency)
+            yield self
+        finally:
+            time.sleep(self.lock_latency)
+            self._lock_owner.release()
+
+    def lock_wait_for(self, interval_sec=2, timeout=None):
+        self._count('lock_wait_for')
+        if not self._lock_owner.acquire(True, -1 if timeout is None else timeout):
+            raise TimeoutError('Eva stand-in lock not available')
+        time.sleep(self.lock_latency)
+
+    def lock_renew(self):
+        with self._request('lock_renew'):
+            if not self._lock_owner.locked():
+                raise EvaStandInError('Eva stand-in lock is not held')
+
+    def lock_unlock(self):
+        self._count('lock_unlock')
+        time.sleep(self.lock_latency)
+        self._lock_owner.release()
+
+    def calc_inverse_kinematics(self, guess, target_position, target_orientation, tolerance=None, perf=None):
+        if self.unreachable is not None and self.unreachable(target_position):
+            with self._request('calc_inverse_kinematics'):
+                return {'ik': {'result': 'error', 'joints': list(guess)}}
+        # Deterministic joints that depend on the target, base joint pointing at it
+        joints = list(guess)
+        joints[0] = math.atan2(target_position['y'], target_position['x'])
+        joints[1] = math.hypot(target_position['x'], target_position['y'])
+        joints[2] = target_position['z']
+        iterations = 1 + int(max(abs(q - q_guess) for q, q_guess in zip(joints, guess)) / 0.01)
+        with self._request('calc_inverse_kinematics', iterations * self.iteration_latency):
+            return {'ik': {'result': 'success', 'joints': joints, 'iterations': iterations}}
+
+    def calc_forward_kinematics(self, joints, fk_type=None, tcp_config=None):
+        with self._request('calc_forward_kinematics'):
+            radius = joints[1]
+            return {'position': {'x': radius * math.cos(joints[0]), 'y': radius * math.sin(joints[0]), 'z': joints[2]},
+                    'orientation': {'w': 0.0, 'x': 0.0, 'y': 1.0, 'z': 0.0}}
+
+    def toolpaths_use(self, toolpathRepr):
+        with self._request('toolpaths_use'):
+            self.toolpath = toolpathRepr
+
+    def control_wait_for_ready(self):
+        # Runs and go-tos return when the motion is over, so the stand-in is always ready here
+        with self._request('control_wait_for_ready'):
+            pass
+
+    def control_run(self, loop=1, wait_for_ready=True, mode='teach'):
+        if self.toolpath is None:
+            raise EvaStandInError('No toolpath loaded')
+        steps = sum(1 for step in self.toolpath['timeline'] if step['type'] == 'trajectory')
+        with self._request('control_run', loop * steps * self.motion_duration):
+            pass
+
+    def control_go_to(self, joints, wait_for_ready=True, velocity=None, duration=None, mode='teach'):
+        with self._request('control_go_to', self.motion_duration):
+            pass
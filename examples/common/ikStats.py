@@ -0,0 +1,38 @@
+import threading
+import numpy as np
+
+
+class IkStats:
+    """Per-call statistics of IK requests: latency, solver iterations (when the solver reports them) and
+    failures. Used to measure the effect of the IK seeding strategy"""
+    def __init__(self):
+        self.latencies = []
+        self.iterations = []
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, result_ik):
+        """latency : duration of the IK call [s]
+        result_ik : IK result, as returned by eva.calc_inverse_kinematics()"""
+        with self._lock:
+            self.latencies.append(latency)
+            if result_ik['ik'].get('iterations') is not None:
+                self.iterations.append(result_ik['ik']['iterations'])
+            if 'success' not in result_ik['ik']['result']:
+                self.failures += 1
+
+    def summary(self):
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000  # [ms]
+            summary = {'calls': len(latencies), 'failures': self.failures}
+            if len(latencies):
+                summary.update({'latency_mean_ms': float(latencies.mean()),
+                                'latency_p50_ms': float(np.percentile(latencies, 50)),
+                                'latency_p95_ms': float(np.percentile(latencies, 95)),
+                                'latency_total_s': float(latencies.sum() / 1000)})
+            if self.iterations:
+                summary['iterations_mean'] = float(np.mean(self.iterations))
+            return summary
+
+    def __str__(self):
+        return ', '.join('{}: {:.4g}'.format(key, value) for key, value in self.summary().items())
@@ -0,0 +1,95 @@
+import numpy as np
+
+
+# Quaternions are [w, x, y, z], w being the real part. Every function takes single values, i.e. a (4,) quaternion
+# and a (3,) vector, or arrays of them, (N, 4) and (N, 3), broadcasting one against the other, so that the poses of a
+# whole grid or of a batch of detections are computed in one call
+
+# Orientation of the end effector pointing downwards, perpendicular to the ground
+HEAD_DOWN = np.array([0.0, 0.0, 1.0, 0.0])
+
+
+def quaternion_multiply(quaternion1, quaternion0):
+    """Hamilton product quaternion1 * quaternion0, (..., 4)"""
+    w0, x0, y0, z0 = np.moveaxis(np.asarray(quaternion0, dtype=np.float64), -1, 0)
+    w1, x1, y1, z1 = np.moveaxis(np.asarray(quaternion1, dtype=np.float64), -1, 0)
+    return np.stack([-x1 * x0 - y1 * y0 - z1 * z0 + w1 * w0,
+                     x1 * w0 + y1 * z0 - z1 * y0 + w1 * x0,
+                     -x1 * z0 + y1 * w0 + z1 * x0 + w1 * y0,
+                     x1 * y0 - y1 * x0 + z1 * w0 + w1 * z0], axis=-1)
+
+
+def quaternion_conjugate(quat):
+    """Conjugate, i.e. inverse rotation, of unit quaternions (..., 4)"""
+    return np.asarray(quat, dtype=np.float64) * np.array([1.0, -1.0, -1.0, -1.0])
+
+
+def axis_angle_to_quaternion(axis, angle):
+    """Unit quaternions (..., 4) of the rotations of angle [rad] (...) about axis (..., 3), not necessarily unit"""
+    axis = np.asarray(axis, dtype=np.float64)
+    axis = axis / np.linalg.norm(axis, axis=-1, keepdims=True)
+    half = 0.5 * np.asarray(angle, dtype=np.float64)[..., np.newaxis]
+    vector = np.sin(half) * axis
+    return np.concatenate([np.broadcast_to(np.cos(half), vector.shape[:-1] + (1,)), vector], axis=-1)
+
+
+def quaternion_to_axis_angle(quat):
+    """Axis (..., 3) and angle [rad] (...), in [0, pi], of unit quaternions (..., 4). The axis of a null rotation is
+    [0, 0, 1]"""
+    quat = np.asarray(quat, dtype=np.float64)
+    # q and -q are the same rotation: take the one with w >= 0, whose angle is at most pi
+    quat = quat * np.where(quat[..., :1] < 0, -1.0, 1.0)
+    norm = np.linalg.norm(quat[..., 1:], axis=-1)
+    angle = 2 * np.arctan2(norm, quat[..., 0])
+    axis = np.where(norm[..., np.newaxis] > 1e-12, quat[..., 1:] / np.maximum(norm, 1e-12)[..., np.newaxis],
+                    np.array([0.0, 0.0, 1.0]))
+    return axis, angle
+
+
+def rotate_vector(quat, vector):
+    """Vectors (..., 3) rotated by unit quaternions (..., 4)"""
+    quat = np.asarray(quat, dtype=np.float64)
+    vector = np.asarray(vector, dtype=np.float64)
+    # v' = v + 2 w (u x v) + 2 u x (u x v), u being the vector part of the quaternion
+    u = quat[..., 1:]
+    uv = np.cross(u, vector)
+    return vector + 2 * quat[..., :1] * uv + 2 * np.cross(u, uv)
+
+
+def head_down_orientation(theta):
+    """Orientation (4,) or (N, 4) of the end effector pointing downwards, rotated by theta [deg] (scalar or (N,))
+    about its own axis, i.e. axis 6"""
+    orient_rel = axis_angle_to_quaternion([0.0, 0.0, 1.0], np.deg2rad(theta))
+    return quaternion_multiply(HEAD_DOWN, orient_rel)
+
+
+def quaternion_to_dict(quat):
+    """Single quaternion (4,) as the orientation dictionary of the Eva SDK"""
+    return {key: float(value) for key, value in zip('wxyz', quat)}
+
+
+def matrix_to_quaternion(rot):
+    """(N, 3, 3) rotation matrices to (N, 4) unit quaternions [w, x, y, z], with w >= 0"""
+    trace = np.trace(rot, axis1=1, axis2=2)
+    # Each row is proportional to the quaternion; the row with the largest diagonal term is the best conditioned
+    candidates = np.stack([
+        np.stack([1 + trace, rot[:, 2, 1] - rot[:, 1, 2], rot[:, 0, 2] - rot[:, 2, 0], rot[:, 1, 0] - rot[:, 0, 1]], -1),
+        np.stack([rot[:, 2, 1] - rot[:, 1, 2], 1 + 2 * rot[:, 0, 0] - trace, rot[:, 0, 1] + rot[:, 1, 0],
+                  rot[:, 0, 2] + rot[:, 2, 0]], -1),
+        np.stack([rot[:, 0, 2] - rot[:, 2, 0], rot[:, 0, 1] + rot[:, 1, 0], 1 + 2 * rot[:, 1, 1] - trace,
+                  rot[:, 1, 2] + rot[:, 2, 1]], -1),
+        np.stack([rot[:, 1, 0] - rot[:, 0, 1], rot[:, 0, 2] + rot[:, 2, 0], rot[:, 1, 2] + rot[:, 2, 1],
+                  1 + 2 * rot[:, 2, 2] - trace], -1)], axis=1)
+    diagonal = np.stack([trace, rot[:, 0, 0], rot[:, 1, 1], rot[:, 2, 2]], axis=-1)
+    quat = candidates[np.arange(rot.shape[0]), np.argmax(diagonal, axis=1)]
+    quat /= np.linalg.norm(quat, axis=1, keepdims=True)
+    return quat * np.where(quat[:, :1] < 0, -1.0, 1.0)
+
+
+def quaternion_to_matrix(quat):
+    """(N, 4) quaternions [w, x, y, z] to (N, 3, 3) rotation matrices"""
+    quat = quat / np.linalg.norm(quat, axis=1, keepdims=True)
+    w, x, y, z = quat.T
+    return np.stack([np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)], -1),
+                     np.stack([2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)], -1),
+                     np.stack([2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)], -1)], axis=1)
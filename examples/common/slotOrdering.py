@@ -0,0 +1,174 @@
+import numpy as np
+
+
+# Slot ordering strategies
+STRATEGIES = ('row_major', 'serpentine', 'nearest_neighbour', 'two_opt')
+# Strategies that search the cost matrix; the others follow the grid layout
+COST_STRATEGIES = ('nearest_neighbour', 'two_opt')
+# Pick-to-drop assignments: pick slot i to drop slot i, or the assignment of least total travel
+ASSIGNMENTS = ('by_index', 'min_travel')
+
+
+def serpentine(rows, cols):
+    """Row-major indices of a rows x cols grid, with every other row reversed"""
+    order = np.arange(rows * cols).reshape(rows, cols)
+    order[1::2] = order[1::2, ::-1]
+    return order.ravel()
+
+
+def joint_travel_time(joints_from, joints_to, joint_speeds):
+    """(N, M) duration [s] of the joint-space moves from each of the (N, 6) joints_from to each of the (M, 6)
+    joints_to [rad], limited by the joint that takes longest at its speed, joint_speeds (6,) [rad/s]"""
+    joints_from = np.asarray(joints_from, dtype=np.float64)
+    joints_to = np.asarray(joints_to, dtype=np.float64)
+    delta = np.abs(joints_from[:, np.newaxis, :] - joints_to[np.newaxis, :, :])
+    return (delta / np.asarray(joint_speeds, dtype=np.float64)).max(axis=2)
+
+
+def path_cost(cost, order):
+    """Cost of visiting the nodes in order, cost[a, b] being the cost of going from a to b"""
+    order = np.asarray(order)
+    return float(cost[order[:-1], order[1:]].sum())
+
+
+def nearest_neighbour(cost, start=0):
+    """Open path from start always moving to the cheapest node not yet visited"""
+    n = cost.shape[0]
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    order[0] = start
+    visited[start] = True
+    for index in range(1, n):
+        order[index] = np.argmin(np.where(visited, np.inf, cost[order[index - 1]]))
+        visited[order[index]] = True
+    return order
+
+
+def two_opt(cost, order, max_passes=50):
+    """Improves an open path, keeping its first node, by reversing the segment that shortens it most as long as
+    one does. The cost matrix can be asymmetric: the reversed segment is costed in its new direction"""
+    order = np.array(order, dtype=np.int64)
+    n = len(order)
+    if n < 4:
+        return order
+    for _ in range(max_passes * n):
+        # Forward and backward cost of the path up to each node
+        forward = np.concatenate([[0.0], np.cumsum(cost[order[:-1], order[1:]])])
+        backward = np.concatenate([[0.0], np.cumsum(cost[order[1:], order[:-1]])])
+        best_delta, best_move = -1e-12, None
+        for i in range(n - 2):
+            # Reversal of order[i + 1 : j + 1], for every j
+            j = np.arange(i + 2, n)
+            after = np.minimum(j + 1, n - 1)
+            has_after = j < n - 1
+            old = (cost[order[i], order[i + 1]] + forward[j] - forward[i + 1] +
+                   np.where(has_after, cost[order[j], order[after]], 0.0))
+            new = (cost[order[i], order[j]] + backward[j] - backward[i + 1] +
+                   np.where(has_after, cost[order[i + 1], order[after]], 0.0))
+            delta = new - old
+            k = int(np.argmin(delta))
+            if delta[k] < best_delta:
+                best_delta, best_move = delta[k], (i, j[k])
+        if best_move is None:
+            break
+        i, j = best_move
+        order[i + 1:j + 1] = order[i + 1:j + 1][::-1].copy()
+    return order
+
+
+def assign(cost):
+    """Minimum-cost assignment of every row to a distinct column of an (N, M) cost matrix, N <= M, with the
+    Hungarian algorithm in O(N^2 M). Returns the column assigned to each row"""
+    n, m = cost.shape
+    if n > m:
+        raise ValueError('Cannot assign {} rows to {} columns'.format(n, m))
+    # Potentials of rows and columns, and row matched to each column (1-based, 0 = none)
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for row in range(1, n + 1):
+        match[0] = row
+        col0 = 0
+        min_reduced = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        # Shortest augmenting path from row to a free column
+        while match[col0] != 0:
+            used[col0] = True
+            row0 = match[col0]
+            reduced = cost[row0 - 1] - u[row0] - v[1:]
+            free = ~used[1:]
+            better = free & (reduced < min_reduced[1:])
+            min_reduced[1:][better] = reduced[better]
+            way[1:][better] = col0
+            candidates = np.where(free, min_reduced[1:], np.inf)
+            col1 = int(np.argmin(candidates)) + 1
+            delta = candidates[col1 - 1]
+            u[match[used]] += delta
+            v[used] -= delta
+            min_reduced[1:][free] -= delta
+            col0 = col1
+        # Augment along the path
+        while col0:
+            col1 = way[col0]
+            match[col0] = match[col1]
+            col0 = col1
+    assignment = np.empty(n, dtype=np.int64)
+    cols = np.flatnonzero(match[1:]) + 1
+    assignment[match[cols] - 1] = cols - 1
+    return assignment
+
+
+def order_slots(cost, strategy, shape=None, start=0):
+    """Visiting order of the nodes of a cost matrix with one of STRATEGIES.
+    cost : (N, N) cost matrix, only read by COST_STRATEGIES and for the size of 'row_major'; None for 'serpentine'
+    shape : (rows, cols) of the grid, for 'serpentine'"""
+    if strategy not in STRATEGIES:
+        raise ValueError('Unknown slot ordering {}, use one of {}'.format(strategy, STRATEGIES))
+    if strategy == 'row_major':
+        return np.arange(cost.shape[0])
+    if strategy == 'serpentine':
+        if shape is None:
+            raise ValueError("The 'serpentine' ordering needs the grid shape")
+        return serpentine(*shape)
+    order = nearest_neighbour(cost, start)
+    if strategy == 'nearest_neighbour':
+        return order
+    return two_opt(cost, order)
+
+
+def plan_cycles(pick_joints, drop_joints, joint_speeds, strategy='row_major', assignment='by_index', shape=None,
+                home=None):
+    """Order of the pick-and-place cycles and drop slot of each pick, minimising the joint-space travel time.
+    pick_joints, drop_joints : (N, 6) and (M, 6) joints of the pick and drop slots [rad], N <= M, i.e. their hover
+     joints, where the arm moves between slots
+    joint_speeds : (6,) speed of each joint [rad/s]
+    strategy : one of STRATEGIES, for the order of the cycles
+    assignment : one of ASSIGNMENTS, for the drop slot of each pick
+    shape : (rows, cols) of the pick grid, for 'serpentine'
+    home : joints the arm returns to between cycles, None if it goes straight to the next pick
+    Returns a dictionary with the pick slots in cycle order ('order'), the drop slot of each of them ('drops'), and
+    the estimated travel time [s] of the plan ('travel') and of row-major order by index ('travel_row_major')"""
+    pick_joints = np.asarray(pick_joints, dtype=np.float64)
+    drop_joints = np.asarray(drop_joints, dtype=np.float64)
+    if assignment not in ASSIGNMENTS:
+        raise ValueError('Unknown assignment {}, use one of {}'.format(assignment, ASSIGNMENTS))
+    n = pick_joints.shape[0]
+    # Travel of each cycle, from its pick to its drop
+    carry = joint_travel_time(pick_joints, drop_joints, joint_speeds)
+    drops = assign(carry) if assignment == 'min_travel' else np.arange(n)
+
+    def transit(drops):
+        # transit[a, b]: travel from the drop of cycle a to the pick of cycle b
+        if home is None:
+            return joint_travel_time(drop_joints[drops], pick_joints, joint_speeds)
+        to_home = joint_travel_time(drop_joints[drops], [home], joint_speeds)
+        from_home = joint_travel_time([home], pick_joints, joint_speeds)
+        return to_home + from_home
+
+    transit_plan = transit(drops)
+    order = order_slots(transit_plan, strategy, shape)
+    transit_row_major = transit(np.arange(n))
+    return {'order': order, 'drops': drops[order],
+            'travel': float(carry[np.arange(n), drops].sum()) + path_cost(transit_plan, order),
+            'travel_row_major': float(np.trace(carry[:, :n])) + path_cost(transit_row_major, np.arange(n))}
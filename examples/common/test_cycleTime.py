@@ -0,0 +1,55 @@
+import os
+import ast
+import unittest
+
+import numpy as np
+from cycleTime import CycleTimeEstimator, wait_time
+
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def _literal(path, name):
+    """Value of the list literal assigned to, or passed as keyword, name in an example script. The scripts are parsed
+    rather than imported, so that neither the Eva SDK nor the camera is needed"""
+    with open(os.path.join(EXAMPLES, path)) as source:
+        tree = ast.parse(source.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and any(getattr(target, 'id', None) == name for target in node.targets):
+            return ast.literal_eval(node.value)
+        if isinstance(node, ast.keyword) and node.arg == name:
+            return ast.literal_eval(node.value)
+    raise LookupError('{} not found in {}'.format(name, path))
+
+
+class WaitDurationTest(unittest.TestCase):
+    """The wait durations of the example timelines are in ms, as on Eva, and estimated in s"""
+    def setUp(self):
+        self.estimator = CycleTimeEstimator()
+        self.grid2grid = _literal(os.path.join('grid2grid', 'main.py'), 'CYCLE_TIMELINE')
+        self.pickup = _literal(os.path.join('machine_vision_object_pickup', 'main.py'), 'timeline')
+
+    def test_durations_in_milliseconds(self):
+        for timeline in (self.grid2grid, self.pickup):
+            for step in timeline:
+                if step['type'] == 'wait' and step['condition']['type'] == 'time':
+                    self.assertGreaterEqual(step['condition']['duration'], 1)
+
+    def test_grid2grid_cycles(self):
+        joints = np.zeros(6)
+        cycle = {step['waypoint']: joints for step in self.grid2grid if step['type'] == 'trajectory'}
+        times = self.estimator.cycles({'default_max_speed': 0.1}, self.grid2grid, [cycle, cycle], joints)
+        np.testing.assert_allclose(times, [0.2, 0.2])
+
+    def test_pickup_toolpath(self):
+        toolpath = {
+            'metadata': {'default_velocity': 1},
+            'waypoints': [{'label_id': index + 1, 'joints': [0.0] * 6} for index in range(4)],
+            'timeline': self.pickup,
+        }
+        self.assertAlmostEqual(wait_time(self.pickup), 0.5)
+        self.assertAlmostEqual(self.estimator.toolpath(toolpath), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
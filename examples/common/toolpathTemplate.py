@@ -0,0 +1,79 @@
+import json
+import hashlib
+import weakref
+
+
+# Digest of the toolpath last uploaded to each robot, to skip uploading the same toolpath again
+_loaded_digests = weakref.WeakKeyDictionary()
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True)
+
+
+def use_toolpath(eva, toolpath, payload=None):
+    """Uploads a toolpath with eva.toolpaths_use(), unless it is identical to the toolpath last uploaded to the same
+    robot through this function. Returns True if the toolpath was uploaded.
+    toolpath : toolpath dictionary, or a ToolpathTemplate
+    payload : optional pre-serialised form of the toolpath, used for the comparison"""
+    if isinstance(toolpath, ToolpathTemplate):
+        toolpath, payload = toolpath.toolpath(), toolpath.payload()
+    if payload is None:
+        payload = _dumps(toolpath)
+    digest = hashlib.sha1(payload.encode('utf-8')).digest()
+    if _loaded_digests.get(eva) == digest:
+        return False
+    eva.toolpaths_use(toolpath)
+    _loaded_digests[eva] = digest
+    return True
+
+
+def forget_loaded_toolpath(eva):
+    """To be called when a toolpath is loaded on the robot by other means than use_toolpath()"""
+    _loaded_digests.pop(eva, None)
+
+
+class ToolpathTemplate:
+    """Reusable toolpath whose invariant parts (metadata, timeline) are built and serialised once.
+    Only the joints of the waypoints change between cycles: set_joints() patches them and re-serialises
+    just the changed waypoints, so that the JSON payload of the toolpath is always available without
+    rebuilding the whole dictionary"""
+    def __init__(self, metadata, waypoint_names, timeline):
+        """metadata : toolpath metadata ('next_label_id' is computed from the waypoints)
+        waypoint_names : names of the waypoints, in order. The waypoint_id of a timeline step is the index
+         of its waypoint in this list
+        timeline : toolpath timeline"""
+        self._names = list(waypoint_names)
+        self._index = {name: index for index, name in enumerate(self._names)}
+        self._metadata = dict(metadata, next_label_id=len(self._names) + 1)
+        self._timeline = timeline
+        self._waypoints = [{"label_id": index + 1, "joints": []} for index in range(len(self._names))]
+        self._fragments = [_dumps(waypoint) for waypoint in self._waypoints]
+        # Serialised form: {"metadata":...,"timeline":...,"waypoints":[<fragments>]}, keys in sorted order
+        self._head = '{"metadata":' + _dumps(self._metadata) + ',"timeline":' + _dumps(self._timeline) + ',"waypoints":['
+        self._payload = None
+
+    def set_joints(self, **joints):
+        """Sets the joints [rad] of the named waypoints, i.e. set_joints(pickup=joints_pickup)"""
+        for name, joints_waypoint in joints.items():
+            index = self._index[name]
+            joints_waypoint = [float(q) for q in joints_waypoint]
+            if joints_waypoint != self._waypoints[index]['joints']:
+                self._waypoints[index] = {"label_id": index + 1, "joints": joints_waypoint}
+                self._fragments[index] = _dumps(self._waypoints[index])
+                self._payload = None
+        return self
+
+    def toolpath(self):
+        """Toolpath dictionary. Its parts are shared with the template and must not be modified"""
+        return {"metadata": self._metadata, "waypoints": list(self._waypoints), "timeline": self._timeline}
+
+    def payload(self):
+        """Cached JSON serialisation of the toolpath"""
+        if self._payload is None:
+            self._payload = self._head + ','.join(self._fragments) + ']}'
+        return self._payload
+
+    def use(self, eva):
+        """Uploads the toolpath to Eva, unless it is already the loaded one. Returns True if uploaded"""
+        return use_toolpath(eva, self)
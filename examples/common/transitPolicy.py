@@ -0,0 +1,29 @@
+# Transit policies, i.e. how the arm moves from one slot to the next:
+#  'home': back to the home position between every two slots
+#  'hover': straight from the hover position above a slot to the hover position above the next one
+#  'safe_plane': up to the safe plane above the slot, across to above the next slot, and down to its hover position
+POLICIES = ('home', 'hover', 'safe_plane')
+
+
+def check_policy(policy):
+    if policy not in POLICIES:
+        raise ValueError('Unknown transit policy {}, use one of {}'.format(policy, POLICIES))
+    return policy
+
+
+def safe_height(slot_heights, hover_height):
+    """Height of the safe plane [m]: hover_height [m] above the highest of the slot_heights [m], i.e. the top of the
+    objects of every grid the arm moves over, tool included"""
+    return max(slot_heights) + hover_height
+
+
+def transit_waypoints(policy, hover_to, home=None, safe_from=None, safe_to=None):
+    """Joints [rad] the arm goes through, in order, from the hover position of a slot to the hover position of the
+    next slot, hover_to [rad], included.
+    home : joints of the home position, for 'home'
+    safe_from, safe_to : joints of the positions on the safe plane above both slots, for 'safe_plane'"""
+    if check_policy(policy) == 'home':
+        return [home, hover_to]
+    if policy == 'hover':
+        return [hover_to]
+    return [safe_from, safe_to, hover_to]
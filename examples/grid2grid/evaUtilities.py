@@ -1,55 +1,150 @@
+import os
+import sys
+import time
 import numpy as np
-from mpl_toolkits.mplot3d import proj3d
-from matplotlib.patches import Rectangle, Circle, FancyBboxPatch, FancyArrowPatch
-import mpl_toolkits.mplot3d.art3d as art3d
-import mpl_toolkits.mplot3d as mp3d
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-from progress.bar import *
-
-
-class Arrow3D(FancyArrowPatch):
-    def __init__(self, xs, ys, zs, *args, **kwargs):
-        FancyArrowPatch.__init__(self, (0, 0), (0, 0), *args, **kwargs)
-        self._verts3d = xs, ys, zs
-
-    def draw(self, renderer):
-        xs3d, ys3d, zs3d = self._verts3d
-        xs, ys, zs = proj3d.proj_transform(xs3d, ys3d, zs3d, renderer.M)
-        self.set_positions((xs[0], ys[0]), (xs[1], ys[1]))
-        FancyArrowPatch.draw(self, renderer)
-
-
-def quaternion_multiply(quaternion1, quaternion0):
-    w0, x0, y0, z0 = quaternion0
-    w1, x1, y1, z1 = quaternion1
-    return np.array([-x1 * x0 - y1 * y0 - z1 * z0 + w1 * w0,
-                     x1 * w0 + y1 * z0 - z1 * y0 + w1 * x0,
-                     -x1 * z0 + y1 * w0 + z1 * x0 + w1 * y0,
-                     x1 * y0 - y1 * x0 + z1 * w0 + w1 * z0], dtype=np.float64)
-
-
-def solve_ik(eva, guess, theta, xyz_absolute):
-    with eva.lock():
-        # Inputs: Theta [deg], xyz_absolute [m]
-        pos = [xyz_absolute[0], xyz_absolute[1], xyz_absolute[2]]  # [m]
-        pos_json = {'x': (pos[0]), 'y': (pos[1]), 'z': (pos[2])}
-        # This provides a rotation of theta [deg] wrt the end effector orientation pointing downwards
-        orient_rel = [np.cos(np.deg2rad(theta)/2), 0, 0, np.sin(np.deg2rad(theta)/2)]
-        orient_abs = quaternion_multiply([0, 0, 1, 0], orient_rel)
-        orient_json = {'w': (orient_abs[0]), 'x': (orient_abs[1]), 'y': (orient_abs[2]), 'z': (orient_abs[3])}
-        # Compute IK
-        result_ik = eva.calc_inverse_kinematics(guess, pos_json, orient_json)
-        success_ik = result_ik['ik']['result']
-        joints_ik = result_ik['ik']['joints']
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from ikCache import IkCache
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from ikStats import IkStats
+from evaKinematics import Kinematics
+from evaLockLease import lock_session
+from transitPolicy import check_policy, safe_height
+from poseMath import head_down_orientation, quaternion_to_dict
+# Plotting (gridPlots, matplotlib) and progress bars (progress) are optional: they are imported on first use
+
+
+class _NoProgressBar:
+    """Stand-in for the progress bars when the progress package is not installed"""
+    def __init__(self, message, max=0):
+        print(message)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def next(self):
+        pass
+
+
+def progress_bar(message, max):
+    """Progress bar of the IK planning, from the progress package when it is installed"""
+    try:
+        from progress.bar import ChargingBar
+    except ImportError:
+        return _NoProgressBar(message, max)
+    return ChargingBar(message, max=max)
+
+
+def _solve_ik_locked(eva, guess, orient_json, xyz_absolute, stats=None):
+    """IK of a pose, to be called while Eva's lock is already held"""
+    # Inputs: orient_json, orientation dictionary of the SDK (i.e. from head_down_orientation()), xyz_absolute [m]
+    pos = [xyz_absolute[0], xyz_absolute[1], xyz_absolute[2]]  # [m]
+    pos_json = {'x': (pos[0]), 'y': (pos[1]), 'z': (pos[2])}
+    # Compute IK
+    start = time.perf_counter()
+    result_ik = eva.calc_inverse_kinematics(guess, pos_json, orient_json)
+    if stats is not None:
+        stats.record(time.perf_counter() - start, result_ik)
+    success_ik = result_ik['ik']['result']
+    joints_ik = result_ik['ik']['joints']
     return success_ik, joints_ik
 
 
+def solve_ik(eva, guess, theta, xyz_absolute, stats=None):
+    # Reuses the lock lease of eva, if there is one
+    with lock_session(eva):
+        return _solve_ik_locked(eva, guess, quaternion_to_dict(head_down_orientation(theta)), xyz_absolute, stats)
+
+
+def solve_ik_batch(eva, guesses, theta, positions, max_workers=4, callback=None, stats=None):
+    """Solves the IK of a batch of positions [m], each with its own guess, acquiring Eva's lock only once,
+    with up to max_workers IK requests in flight. Results are returned in the order of the positions.
+    Solving stops at the first unreachable position: the entries after it are None"""
+    results = [None] * len(positions)
+    if not positions:
+        return results
+    orient_json = quaternion_to_dict(head_down_orientation(theta))
+    with lock_session(eva):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_solve_ik_locked, eva, guess, orient_json, pos, stats)
+                       for guess, pos in zip(guesses, positions)]
+            try:
+                for index, future in enumerate(futures):
+                    results[index] = future.result()
+                    if callback is not None:
+                        callback()
+                    if 'success' not in results[index][0]:
+                        break
+            finally:
+                for future in futures:
+                    future.cancel()
+    return results
+
+
+def solve_ik_local(kinematics, guesses, theta, positions, callback=None, stats=None):
+    """Solves the IK of a batch of positions [m], each with its own guess, in a single vectorized call of the
+    local kinematics backend. Results are returned as by solve_ik_batch(), None after the first unreachable position"""
+    results = [None] * len(positions)
+    if not positions:
+        return results
+    start = time.perf_counter()
+    success, joints, iterations = kinematics.inverse(guesses, positions, head_down_orientation(theta))
+    latency = (time.perf_counter() - start) / len(positions)
+    for index in range(len(positions)):
+        result_ik = {'ik': {'result': 'success' if success[index] else 'error', 'joints': joints[index].tolist(),
+                            'iterations': int(iterations[index])}}
+        if stats is not None:
+            stats.record(latency, result_ik)
+        results[index] = result_ik['ik']['result'], result_ik['ik']['joints']
+        if callback is not None:
+            callback()
+        if not success[index]:
+            break
+    return results
+
+
+def create_grid(config, grid_iter):
+    """Creates 2D grid from YAML configuration file
+    grid: (row, col, 3) array containing all grid points, in cartesian space.
+    grid_points: (row*col, 3) row-major view of the same buffer.
+     Units: [mm]"""
+    row = abs(config['grids']['row'][grid_iter])
+    col = abs(config['grids']['col'][grid_iter])
+    row_pitch = abs(config['grids']['row_pitch'][grid_iter])
+    col_pitch = abs(config['grids']['col_pitch'][grid_iter])
+    x0 = config['grids']['x0'][grid_iter]
+    y0 = config['grids']['y0'][grid_iter]
+    surface = config['grids']['surface'][grid_iter]
+    theta = np.deg2rad(config['grids']['angle'][grid_iter])
+    # Column and row displacement vectors of the rotated grid, in the xy plane
+    col_step = col_pitch * np.array([np.cos(theta + np.pi / 2), np.sin(theta + np.pi / 2)])
+    row_step = row_pitch * np.array([np.sin(theta + np.pi / 2), -np.cos(theta + np.pi / 2)])
+    i = np.arange(row, dtype=np.float64)[:, np.newaxis, np.newaxis]
+    j = np.arange(col, dtype=np.float64)[np.newaxis, :, np.newaxis]
+    grid = np.empty((row, col, 3), dtype=np.float64)
+    grid[:, :, :2] = i * row_step + j * col_step + np.array([x0, y0])
+    grid[:, :, 2] = surface
+    grid_points = grid.reshape(-1, 3)
+
+    return grid, grid_points
+
+
 class EvaGrids:
-    def __init__(self, eva, config, show_plot):
+    def __init__(self, eva, config, show_plot, rebuild_ik_cache=None):
         self.config = config
         self.eva = eva
         self.show_plot = show_plot
+        # Image file the grid plots are written to instead of being shown, i.e. without a display
+        self.plot_file = self.config.get('plot', {}).get('file') or None
+        # Persistent IK solutions, reused across runs while the grids do not change
+        self.ik_cache = None
+        cache_config = self.config.get('ik_cache', {})
+        if cache_config.get('enabled', False):
+            rebuild = cache_config.get('rebuild', False) if rebuild_ik_cache is None else rebuild_ik_cache
+            self.ik_cache = IkCache(os.path.join(os.getcwd(), cache_config['file']), rebuild)
         self.counter_max = {self.config['grids']['names'][0]: self.config['grids']['row'][self.config['grids']['names'][0]]*self.config['grids']['col'][self.config['grids']['names'][0]]-1,
                             self.config['grids']['names'][1]: self.config['grids']['row'][self.config['grids']['names'][1]]*self.config['grids']['col'][self.config['grids']['names'][1]]-1}
         # Check that slots in second grid are >= than first grid
@@ -57,72 +152,128 @@ class EvaGrids:
                  abs(self.config['grids']['row'][self.config['grids']['names'][1]]) * abs(self.config['grids']['col'][self.config['grids']['names'][1]])]
         if slots[0] > slots[1]:
             raise Exception('Drop-off grid is smaller than pick-up grid')
+        # IK planning: 'serial' locks Eva for each IK call, 'concurrent' locks once per grid and
+        # keeps up to max_workers IK requests in flight
+        self.planning_mode = self.config.get('planning', {}).get('mode', 'serial')
+        self.max_workers = self.config.get('planning', {}).get('max_workers', 4)
+        # IK seeding: 'fixed' uses the YAML guess for every slot, 'neighbour' seeds each pick with the
+        # solution of its already-solved neighbour slot and each hover with its own pick solution
+        self.guess_strategy = self.config.get('planning', {}).get('guess', 'fixed')
+        self.ik_stats = IkStats()
+        # FK/IK backend: 'remote' (Eva), 'local' (NumPy model of the arm) or 'checked' (local, cross-checked with Eva)
+        self.kinematics = Kinematics.from_config(eva, self.config)
+        # Moves between consecutive slots: 'home', 'hover' or 'safe_plane' (see transitPolicy.POLICIES)
+        self.transit_policy = check_policy(self.config.get('transit', {}).get('policy', 'home'))
+
+    def safe_height(self):
+        """Height of the safe plane [m]: hover_height above the top of the objects of both grids, tool included"""
+        grids = self.config['grids']
+        slot_heights = [(grids['surface'][grid_iter] + abs(grids['object'][grid_iter]) +
+                         abs(self.config['EVA']['end_effector']['length'])) / 1000 for grid_iter in grids['names']]
+        return safe_height(slot_heights, abs(self.config['EVA']['hover_height']))
 
     def _create_grid(self, grid_iter):
-        """Creates 2D grid from YAML configuration file
-        grid_x, grid_y: list of lists containing all grid points, in cartesian space.
-         Units: [m]"""
-        row = abs(self.config['grids']['row'][grid_iter])
-        col = abs(self.config['grids']['col'][grid_iter])
-        row_pitch = abs(self.config['grids']['row_pitch'][grid_iter])
-        col_pitch = abs(self.config['grids']['col_pitch'][grid_iter])
-        x0 = self.config['grids']['x0'][grid_iter]
-        y0 = self.config['grids']['y0'][grid_iter]
-        surface = self.config['grids']['surface'][grid_iter]
-        theta = np.deg2rad(self.config['grids']['angle'][grid_iter])
-        grid_x = [[0 for _i in range(col)] for _j in range(row)]
-        grid_y = [[0 for _i in range(col)] for _j in range(row)]
-        grid_z = [[0 for _i in range(col)] for _j in range(row)]
-        grid_points = []
-        for i in range(row):
-            for j in range(col):
-                grid_x[i][j] = (np.cos(theta+np.pi/2)*col_pitch*j+np.sin(theta+np.pi/2)*row_pitch*i)+x0
-                grid_y[i][j] = -(-np.sin(theta+np.pi/2)*col_pitch*j+np.cos(theta+np.pi/2)*row_pitch*i)+y0
-                grid_z[i][j] = surface
-        for i in range(row):
-            for j in range(col):
-                grid_points.append([grid_x[i][j], grid_y[i][j], grid_z[i][j]])
-
-        return grid_x, grid_y, grid_z, grid_points
-
-    def get_grid_points(self, grids):
+        return create_grid(self.config, grid_iter)
+
+    def get_grid_points(self, grids, confirm=True, slots=None):
         """Creates 2D grid using the _create_grid() method and extract the grid point
         corresponding to the object_name and counter selected. It then solves the IK
         for the pickup point [x, y, z] and the hover point [x, y, z + z_hover] and
-        provides the corresponding joint angles"""
+        provides the corresponding joint angles. With confirm=False the user is not asked
+        to verify the grids before moving the robot, i.e. for unattended benchmarks.
+        slots : optional dictionary of the slots to plan in each grid, i.e. the share of a robot in a multi-robot
+         job. The joints of the other slots are None"""
         if self.show_plot:
-            fig = plt.figure(figsize=(10, 5))
-            plt.style.use('seaborn-pastel')
-            ax = [fig.add_subplot(121), fig.add_subplot(122, projection='3d')]
-        joints = {grids[0]: {'pick': [], 'hover': []}, grids[1]: {'pick': [], 'hover': []}}
+            from gridPlots import plot_figure
+            fig, ax = plot_figure(self.plot_file)
+        # Joints of the pick positions and of the positions above them, where the arm moves between slots: the
+        # hover positions, and the positions on the safe plane for the 'safe_plane' transit policy
+        lifts = ['hover', 'safe'] if self.transit_policy == 'safe_plane' else ['hover']
+        joints = {grid_iter: {pose: [] for pose in ['pick'] + lifts} for grid_iter in grids}
 
         for grid_iter in grids:
             obj_h = abs(self.config['grids']['object'][grid_iter])
             ee_h = abs(self.config['EVA']['end_effector']['length'])
             hover_h = abs(self.config['EVA']['hover_height'])
             guess = self.config['grids']['guess'][grid_iter]
-            grid_x, grid_y, grid_z, grid_points = self._create_grid(grid_iter)
-
-            with ChargingBar('Computing ' + self.config['grids']['names_verbose'][grid_iter] + ' grid',
-                             max=len(grid_points)) as bar:
-                for _counter in range(len(grid_points)):
-                    x = grid_points[_counter][0]/1000  # [m]
-                    y = grid_points[_counter][1]/1000  # [m]
-                    z = (grid_points[_counter][2]+ee_h+obj_h)/1000  # [m]
-                    pos_obj = [x, y, z]  # [m]
-                    pos_obj_hover = [x, y, z + hover_h]  # [m]
-                    extra_angle = self.config['grids']['angle_pickup'][grid_iter]     # Additional pickup angle
-                    success_pick, joints_pick = solve_ik(self.eva, guess, extra_angle, pos_obj)
-                    success_hover, joints_hover = solve_ik(self.eva, guess, extra_angle, pos_obj_hover)
-                    if ('success' not in success_pick) or ('success' not in success_hover):
-                        raise Exception('IK error')  # Failed IK. Position not reachable
-                    joints[grid_iter]['pick'].append(joints_pick)
-                    joints[grid_iter]['hover'].append(joints_hover)
-                    bar.next()
+            grid, grid_points = self._create_grid(grid_iter)
+            # Pickup and hover positions for every slot, [m]
+            pos_pick = grid_points / 1000
+            pos_pick[:, 2] += (ee_h + obj_h) / 1000
+            pos_hover = pos_pick.copy()
+            pos_hover[:, 2] += hover_h
+            pos_lift = {'hover': pos_hover}
+            if 'safe' in lifts:
+                pos_lift['safe'] = pos_pick.copy()
+                pos_lift['safe'][:, 2] = self.safe_height()
+            extra_angle = self.config['grids']['angle_pickup'][grid_iter]     # Additional pickup angle
+            selected = np.ones(len(grid_points), dtype=bool)
+            if slots is not None:
+                selected[:] = False
+                selected[list(slots[grid_iter])] = True
+
+            # Cached solutions for unchanged slots, None where IK has to be solved
+            cached_pick = [None] * len(grid_points)
+            cached_lift = {pose: [None] * len(grid_points) for pose in lifts}
+            if self.ik_cache is not None:
+                solver = IkCache.solver_hash(self.kinematics)
+                keys_pick = IkCache.entry_keys(guess, extra_angle, pos_pick, self.guess_strategy, solver)
+                keys_lift = {pose: IkCache.entry_keys(guess, extra_angle, pos_lift[pose], self.guess_strategy, solver)
+                             for pose in lifts}
+                cached_pick = self.ik_cache.lookup(keys_pick)
+                cached_lift = {pose: self.ik_cache.lookup(keys_lift[pose]) for pose in lifts}
+                if self.guess_strategy == 'neighbour' and any(cached_pick[_counter] is None
+                                                              for _counter in np.flatnonzero(selected)):
+                    # Each slot is seeded with the solution of its neighbour, and the lifts with the pick joints:
+                    # a changed slot changes the seeds of the following ones, so the whole grid is solved again
+                    cached_pick = [None] * len(grid_points)
+                    cached_lift = {pose: [None] * len(grid_points) for pose in lifts}
+                reused = sum(1 for _counter in np.flatnonzero(selected) if cached_pick[_counter] is not None)
+                if reused:
+                    print('Reusing cached IK solutions for {} of {} slots of the {} grid'.format(
+                        reused, np.count_nonzero(selected), self.config['grids']['names_verbose'][grid_iter]))
+
+            joints[grid_iter]['pick'] = list(cached_pick)
+            for pose in lifts:
+                joints[grid_iter][pose] = list(cached_lift[pose])
+
+            missing = sum(1 for _counter in np.flatnonzero(selected) for cached in [cached_pick] +
+                          [cached_lift[pose] for pose in lifts] if cached[_counter] is None)
+            with progress_bar('Computing ' + self.config['grids']['names_verbose'][grid_iter] + ' grid',
+                              max=missing) as bar:
+                # IK requests in slot order, pick before hover and safe: (slot, pick/hover/safe, guess, position [m])
+                requests = []
+                if self.guess_strategy == 'neighbour':
+                    self._solve_ik_chain(grid_iter, grid.shape[1], guess, extra_angle, pos_pick,
+                                         joints[grid_iter]['pick'], bar.next, selected)
+                else:
+                    requests += [(_counter, 'pick', guess, pos_pick[_counter].tolist())
+                                 for _counter in np.flatnonzero(selected) if cached_pick[_counter] is None]
+                for pose in lifts:
+                    requests += [(_counter, pose, joints[grid_iter]['pick'][_counter] if self.guess_strategy == 'neighbour'
+                                  else guess, pos_lift[pose][_counter].tolist())
+                                 for _counter in np.flatnonzero(selected) if cached_lift[pose][_counter] is None]
+                requests.sort(key=lambda request: request[0])
+                results = self._solve_ik_requests([request[2] for request in requests], extra_angle,
+                                                  [request[3] for request in requests], bar.next)
+                for (_counter, pose, _guess, _pos), result in zip(requests, results):
+                    if result is None or 'success' not in result[0]:
+                        raise self._ik_error(grid_iter, pose, _counter)
+                    joints[grid_iter][pose][_counter] = result[1]
+                if self.ik_cache is not None:
+                    self.ik_cache.store(keys_pick, joints[grid_iter]['pick'])
+                    for pose in lifts:
+                        self.ik_cache.store(keys_lift[pose], joints[grid_iter][pose])
                 if self.show_plot:
-                    self.plot_grids(grid_x, grid_y, grid_z, ax, grid_iter)
+                    self.plot_grids(grid, ax, grid_iter)
+        if self.ik_cache is not None:
+            self.ik_cache.save()
+        print('IK requests - ' + str(self.ik_stats))
         if self.show_plot:
-            plt.show()
+            from gridPlots import show_figure
+            show_figure(fig, self.plot_file)
+        if not confirm:
+            return joints
         move_eva = input("Please verify the correctness of grid placement before continuing "
                          "(to do this, set plot_on_off variable to True and verify grids placement from the plots).\n"
                          "Proceed (this will move the robot)? yes/no\n")
@@ -131,71 +282,53 @@ class EvaGrids:
                             '- run the script again\n - verify grids placement from the plots ')
         return joints
 
-    def plot_grids(self, grid_x, grid_y, grid_z, ax_all, grid_iter):
-        all_points = []
-        ax1 = ax_all[0]
-        ax2 = ax_all[1]
-
-        # Plot settings
-        grid_color = {'A': 'blue', 'B': 'red'}
-        box_side = 600
-        arr_length = 300
-        work = Circle((0, 0), self.config['EVA']['work_radius'] * 1000, color='k', alpha=0.1)
-        base = self.config['EVA']['base_plate'] * 1000 / 2
-
-        # 2D Plot
-        base_plate_2d = FancyBboxPatch((-base, -base), base * 2, base * 2, edgecolor='black', facecolor='gray',
-                                       alpha=0.2)
-        io_port_2d = Rectangle((-0.08 * 1000, -0.08 * 1000 / 2), 0.015 * 1000, 0.08 * 1000, edgecolor='green',
-                               facecolor='green')
-        grid_vertices_2d = [(grid_x[0][0], grid_y[0][0]), (grid_x[-1][0], grid_y[-1][0]),
-                            (grid_x[-1][-1], grid_y[-1][-1]), (grid_x[0][-1], grid_y[0][-1])]
-        grid_footprint_2d = mp3d.art3d.PolyCollection([grid_vertices_2d], color=grid_color[grid_iter], alpha=0.3)
-        ax1.add_artist(plt.Circle((0, 0), self.config['EVA']['work_radius'] * 1000, facecolor='gray', alpha=0.1))
-        ax1.add_patch(base_plate_2d), ax1.add_patch(io_port_2d)
-        ax1.set_xlim(-box_side, box_side), ax1.set_ylim(-box_side, box_side)
-        ax1.set_aspect('equal'), ax1.set_xlabel('x [mm]'), ax1.set_ylabel('y [mm]')
-        ax1.arrow(0, 0, 200, 0, head_width=10, head_length=10, fc='red', ec='red', linewidth=2, alpha=0.6)
-        ax1.arrow(0, 0, 0, 200, head_width=10, head_length=10, fc='green', ec='green', linewidth=2, alpha=0.6)
-        ax1.plot(0, 0, 'o', markersize=5, color='blue', alpha=0.6)
-        ax1.plot(grid_x, grid_y, 'o', color='grey', markersize=2)
-        ax1.plot(grid_x[0][0], grid_y[0][0], '*', markersize=10, color='green')  # First point
-        ax1.plot(grid_x[-1][-1], grid_y[-1][-1], 'X', markersize=8, color='red')  # Last point
-        ax1.add_collection(grid_footprint_2d)
-        blue_patch = mpatches.Patch(color='blue', label='Origin grid', alpha=0.4)
-        red_patch = mpatches.Patch(color='red', label='Target grid', alpha=0.4)
-        plt.legend(handles=[blue_patch, red_patch])
-
-        for i in range(self.config['grids']['row'][grid_iter]):
-            for j in range(self.config['grids']['col'][grid_iter]):
-                all_points.append([grid_x[i][j], grid_y[i][j]])
-
-        for i in range(len(all_points) - 1):
-            ax1.arrow(all_points[i][0], all_points[i][1], (all_points[i + 1][0] - all_points[i][0]),
-                      (all_points[i + 1][1] - all_points[i][1]), head_width=15, head_length=15,
-                      fc='black', ec='black', linewidth=1, alpha=0.5)
-
-        # 3D Plot
-        base_plate_3d = [(-base, -base, 0), (base, -base, 0), (base, base, 0), (-base, base, 0)]
-        base_plate_shape_3d = mp3d.art3d.Poly3DCollection([base_plate_3d], color='black', alpha=0.5, linewidth=1)
-        grid_vertices_3d = [(grid_x[0][0], grid_y[0][0], grid_z[0][0]), (grid_x[-1][0], grid_y[-1][0], grid_z[0][0]),
-                            (grid_x[-1][-1], grid_y[-1][-1], grid_z[0][0]),
-                            (grid_x[0][-1], grid_y[0][-1], grid_z[0][0])]
-        grid_footprint_3d = mp3d.art3d.Poly3DCollection([grid_vertices_3d], color=grid_color[grid_iter], alpha=0.3)
-
-        a = Arrow3D([0, arr_length], [0, 0], [0, 0], mutation_scale=5, lw=1, arrowstyle="-|>", color="r")
-        b = Arrow3D([0, 0], [0, arr_length], [0, 0], mutation_scale=5, lw=1, arrowstyle="-|>", color="g")
-        c = Arrow3D([0, 0], [0, 0], [0, 0.5 * arr_length], mutation_scale=5, lw=1, arrowstyle="-|>", color="b")
-
-        ax2.set_facecolor('white')
-        ax2.add_collection3d(base_plate_shape_3d)
-        ax2.add_patch(work)
-        art3d.pathpatch_2d_to_3d(work, z=0, zdir="z")
-        ax2.add_artist(a), ax2.add_artist(b), ax2.add_artist(c)
-        ax2.xaxis.pane.set_edgecolor('black'), ax2.yaxis.pane.set_edgecolor('black'), ax2.zaxis.pane.set_edgecolor(
-            'black')
-        ax2.set_xlabel('x [mm]'), ax2.set_ylabel('y [mm]'), ax2.set_zlabel('z [mm]')
-        ax2.set_xlim(-box_side, box_side), ax2.set_ylim(-box_side, box_side), ax2.set_zlim(0, 0.5 * box_side)
-        ax2.add_collection3d(grid_footprint_3d)
-        ax2.scatter(grid_x, grid_y, grid_z, 'o', s=2, color='black')
-        ax2.scatter(grid_x[0][0], grid_y[0][0], grid_z[0][0], '*', s=10, color='green')  # First point
+    def _ik_error(self, grid_iter, pose, slot):
+        # Failed IK. Position not reachable
+        return Exception('IK error: {} slot {} of the {} grid is not reachable'.format(
+            pose, slot, self.config['grids']['names_verbose'][grid_iter]))
+
+    def _solve_ik_chain(self, grid_iter, col, guess, theta, positions, solved, callback, selected):
+        """Solves, in slot order, the IK of the selected positions [m] whose entry in solved is None. Each slot is
+        seeded with the solution of its already-solved neighbour: the previous slot of the same row, or the first
+        slot of the previous row. The first slot, and slots whose neighbour is not planned, fall back to the YAML
+        guess"""
+        if not any(solved[slot] is None for slot in np.flatnonzero(selected)):
+            return
+        concurrent = self.planning_mode == 'concurrent'
+        orient_json = quaternion_to_dict(head_down_orientation(theta))
+        with self.kinematics.lock() if concurrent else nullcontext():
+            for slot in np.flatnonzero(selected):
+                if solved[slot] is not None:
+                    continue
+                neighbour = slot - 1 if slot % col else slot - col
+                seed = solved[neighbour] if neighbour >= 0 and solved[neighbour] is not None else guess
+                with nullcontext() if concurrent else lock_session(self.kinematics):
+                    success_ik, joints_ik = _solve_ik_locked(self.kinematics, seed, orient_json,
+                                                             positions[slot].tolist(), self.ik_stats)
+                callback()
+                if 'success' not in success_ik:
+                    raise self._ik_error(grid_iter, 'pick', slot)
+                solved[slot] = joints_ik
+
+    def _solve_ik_requests(self, guesses, theta, positions, callback):
+        """Solves the IK of a list of positions [m] with the selected planning mode. Results are in the order
+        of the positions and solving stops at the first failure, leaving None for the remaining entries.
+        With a local kinematics backend, all the positions are solved at once"""
+        if self.kinematics.backend != 'remote':
+            return solve_ik_local(self.kinematics, guesses, theta, positions, callback, self.ik_stats)
+        if self.planning_mode == 'concurrent':
+            return solve_ik_batch(self.kinematics, guesses, theta, positions, self.max_workers, callback,
+                                  self.ik_stats)
+        results = [None] * len(positions)
+        orient_json = quaternion_to_dict(head_down_orientation(theta))
+        for index, (guess, pos) in enumerate(zip(guesses, positions)):
+            with lock_session(self.kinematics):
+                results[index] = _solve_ik_locked(self.kinematics, guess, orient_json, pos, self.ik_stats)
+            callback()
+            if 'success' not in results[index][0]:
+                break
+        return results
+
+    def plot_grids(self, grid, ax_all, grid_iter):
+        from gridPlots import plot_grids
+        plot_grids(self.config, grid, ax_all, grid_iter)
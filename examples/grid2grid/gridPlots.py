@@ -0,0 +1,117 @@
+import os
+import numpy as np
+from mpl_toolkits.mplot3d import proj3d
+from matplotlib.patches import Rectangle, Circle, FancyBboxPatch, FancyArrowPatch
+import mpl_toolkits.mplot3d.art3d as art3d
+import mpl_toolkits.mplot3d as mp3d
+import matplotlib.pyplot as plt
+import matplotlib.patches as mpatches
+from matplotlib.figure import Figure
+
+# Plots of the grids, for their verification before moving the robot. This module is only imported when plotting,
+# so that matplotlib is not needed, nor loaded, by the planning
+
+# Style of the grid plots, renamed in matplotlib 3.6
+PLOT_STYLE = 'seaborn-pastel' if 'seaborn-pastel' in plt.style.available else 'seaborn-v0_8-pastel'
+
+
+class Arrow3D(FancyArrowPatch):
+    def __init__(self, xs, ys, zs, *args, **kwargs):
+        FancyArrowPatch.__init__(self, (0, 0), (0, 0), *args, **kwargs)
+        self._verts3d = xs, ys, zs
+
+    def draw(self, renderer):
+        self.do_3d_projection(renderer)
+        FancyArrowPatch.draw(self, renderer)
+
+    def do_3d_projection(self, renderer=None):
+        # Called by the 3D axes before drawing (matplotlib >= 3.5), to sort the artists by depth
+        xs3d, ys3d, zs3d = self._verts3d
+        xs, ys, zs = proj3d.proj_transform(xs3d, ys3d, zs3d, self.axes.M)
+        self.set_positions((xs[0], ys[0]), (xs[1], ys[1]))
+        return np.min(zs)
+
+
+def plot_figure(plot_file=None):
+    """Figure and axes (2D, 3D) of the grid plots. With a plot file, the figure is built without pyplot, so it
+    is rendered by the Agg backend and needs no display"""
+    plt.style.use(PLOT_STYLE)
+    fig = plt.figure(figsize=(10, 5)) if plot_file is None else Figure(figsize=(10, 5))
+    return fig, [fig.add_subplot(121), fig.add_subplot(122, projection='3d')]
+
+
+def show_figure(fig, plot_file=None):
+    """Shows the figure of plot_figure(), or writes it to plot_file"""
+    if plot_file is None:
+        plt.show()
+    else:
+        fig.savefig(plot_file, dpi=150)
+        print('Grid plots written to ' + os.path.abspath(plot_file))
+
+
+def plot_grids(config, grid, ax_all, grid_iter):
+    """Draws a grid, (row, col, 3) [mm], and its pick-up order on the axes of plot_figure()"""
+    grid_x, grid_y, grid_z = grid[:, :, 0], grid[:, :, 1], grid[:, :, 2]
+    all_points = grid.reshape(-1, 3)[:, :2]
+    ax1 = ax_all[0]
+    ax2 = ax_all[1]
+
+    # Plot settings
+    grid_color = {'A': 'blue', 'B': 'red'}
+    box_side = 600
+    arr_length = 300
+    work = Circle((0, 0), config['EVA']['work_radius'] * 1000, color='k', alpha=0.1)
+    base = config['EVA']['base_plate'] * 1000 / 2
+
+    # 2D Plot
+    base_plate_2d = FancyBboxPatch((-base, -base), base * 2, base * 2, edgecolor='black', facecolor='gray',
+                                   alpha=0.2)
+    io_port_2d = Rectangle((-0.08 * 1000, -0.08 * 1000 / 2), 0.015 * 1000, 0.08 * 1000, edgecolor='green',
+                           facecolor='green')
+    grid_vertices_2d = [(grid_x[0][0], grid_y[0][0]), (grid_x[-1][0], grid_y[-1][0]),
+                        (grid_x[-1][-1], grid_y[-1][-1]), (grid_x[0][-1], grid_y[0][-1])]
+    grid_footprint_2d = mp3d.art3d.PolyCollection([grid_vertices_2d], color=grid_color[grid_iter], alpha=0.3)
+    ax1.add_artist(plt.Circle((0, 0), config['EVA']['work_radius'] * 1000, facecolor='gray', alpha=0.1))
+    ax1.add_patch(base_plate_2d), ax1.add_patch(io_port_2d)
+    ax1.set_xlim(-box_side, box_side), ax1.set_ylim(-box_side, box_side)
+    ax1.set_aspect('equal'), ax1.set_xlabel('x [mm]'), ax1.set_ylabel('y [mm]')
+    ax1.arrow(0, 0, 200, 0, head_width=10, head_length=10, fc='red', ec='red', linewidth=2, alpha=0.6)
+    ax1.arrow(0, 0, 0, 200, head_width=10, head_length=10, fc='green', ec='green', linewidth=2, alpha=0.6)
+    ax1.plot(0, 0, 'o', markersize=5, color='blue', alpha=0.6)
+    ax1.plot(all_points[:, 0], all_points[:, 1], 'o', color='grey', markersize=2)
+    ax1.plot(grid_x[0][0], grid_y[0][0], '*', markersize=10, color='green')  # First point
+    ax1.plot(grid_x[-1][-1], grid_y[-1][-1], 'X', markersize=8, color='red')  # Last point
+    ax1.add_collection(grid_footprint_2d)
+    blue_patch = mpatches.Patch(color='blue', label='Origin grid', alpha=0.4)
+    red_patch = mpatches.Patch(color='red', label='Target grid', alpha=0.4)
+    ax1.legend(handles=[blue_patch, red_patch])
+
+    # Pick-up order: a single artist with an arrow from every point to the next one
+    steps = np.diff(all_points, axis=0)
+    ax1.quiver(all_points[:-1, 0], all_points[:-1, 1], steps[:, 0], steps[:, 1], angles='xy', scale_units='xy',
+               scale=1, width=0.002, headwidth=5, color='black', alpha=0.5)
+
+    # 3D Plot
+    base_plate_3d = [(-base, -base, 0), (base, -base, 0), (base, base, 0), (-base, base, 0)]
+    base_plate_shape_3d = mp3d.art3d.Poly3DCollection([base_plate_3d], color='black', alpha=0.5, linewidth=1)
+    grid_vertices_3d = [(grid_x[0][0], grid_y[0][0], grid_z[0][0]), (grid_x[-1][0], grid_y[-1][0], grid_z[0][0]),
+                        (grid_x[-1][-1], grid_y[-1][-1], grid_z[0][0]),
+                        (grid_x[0][-1], grid_y[0][-1], grid_z[0][0])]
+    grid_footprint_3d = mp3d.art3d.Poly3DCollection([grid_vertices_3d], color=grid_color[grid_iter], alpha=0.3)
+
+    a = Arrow3D([0, arr_length], [0, 0], [0, 0], mutation_scale=5, lw=1, arrowstyle="-|>", color="r")
+    b = Arrow3D([0, 0], [0, arr_length], [0, 0], mutation_scale=5, lw=1, arrowstyle="-|>", color="g")
+    c = Arrow3D([0, 0], [0, 0], [0, 0.5 * arr_length], mutation_scale=5, lw=1, arrowstyle="-|>", color="b")
+
+    ax2.set_facecolor('white')
+    ax2.add_collection3d(base_plate_shape_3d)
+    ax2.add_patch(work)
+    art3d.pathpatch_2d_to_3d(work, z=0, zdir="z")
+    ax2.add_artist(a), ax2.add_artist(b), ax2.add_artist(c)
+    ax2.xaxis.pane.set_edgecolor('black'), ax2.yaxis.pane.set_edgecolor('black'), ax2.zaxis.pane.set_edgecolor(
+        'black')
+    ax2.set_xlabel('x [mm]'), ax2.set_ylabel('y [mm]'), ax2.set_zlabel('z [mm]')
+    ax2.set_xlim(-box_side, box_side), ax2.set_ylim(-box_side, box_side), ax2.set_zlim(0, 0.5 * box_side)
+    ax2.add_collection3d(grid_footprint_3d)
+    ax2.scatter(grid_x.ravel(), grid_y.ravel(), grid_z.ravel(), 'o', s=2, color='black')
+    ax2.scatter(grid_x[0][0], grid_y[0][0], grid_z[0][0], '*', s=10, color='green')  # First point
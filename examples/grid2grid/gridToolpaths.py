@@ -0,0 +1,92 @@
+import copy
+
+
+# Timeline steps around a cycle for each transit policy (see transitPolicy.POLICIES): from the end of the previous
+# cycle to the hover position of the pick slot, and from the hover position of the drop slot onwards
+TRANSIT_STEPS = {
+    'home': (
+        [{"type": "trajectory", "trajectory": "joint_space", "waypoint": "pick_hover"}],
+        [{"type": "trajectory", "trajectory": "joint_space", "waypoint": "home"}],
+    ),
+    'hover': (
+        [{"type": "trajectory", "trajectory": "joint_space", "waypoint": "pick_hover"}],
+        [],
+    ),
+    'safe_plane': (
+        [{"type": "trajectory", "trajectory": "joint_space", "waypoint": "pick_safe"},
+         {"type": "trajectory", "trajectory": "linear", "waypoint": "pick_hover"}],
+        [{"type": "trajectory", "trajectory": "linear", "waypoint": "drop_safe"}],
+    ),
+}
+
+
+def transit_timeline(cycle_timeline, policy):
+    """Timeline of a whole cycle: cycle_timeline, from the hover position of the pick slot to the hover position of
+    the drop slot, with the transit steps of the policy around it"""
+    approach, retract = TRANSIT_STEPS[policy]
+    return approach + cycle_timeline + retract
+
+
+def _waypoint_key(joints):
+    return tuple(round(float(q), 9) for q in joints)
+
+
+def compile_toolpaths(metadata, cycle_timeline, cycles, home, max_waypoints=100, max_timeline=1000, max_cycles=None):
+    """Compiles the pick-and-place cycles of a whole grid run into as few toolpaths as possible.
+    metadata : toolpath metadata, copied into every toolpath ('next_label_id' is recomputed)
+    cycle_timeline : timeline of one cycle, where trajectory steps reference a waypoint by name with a 'waypoint'
+     key instead of 'waypoint_id'. Steps whose waypoint has no joints (i.e. unused user-defined operations) are skipped
+    cycles : list of dictionaries, one per cycle, mapping each waypoint name to its joints [rad]
+    home : joints of the home position [rad], the first waypoint of the first toolpath. The next toolpaths start
+     where the previous one ends
+    max_waypoints, max_timeline : size limits of a single toolpath. The cycles are split into consecutive chunks
+     respecting them; repeated waypoints are stored only once per toolpath
+    max_cycles : maximum number of cycles of a single toolpath, None for no limit"""
+    toolpaths = []
+    chunk = None
+    position = home
+    for cycle_index, cycle in enumerate(cycles):
+        cycle_steps = [step for step in cycle_timeline if 'waypoint' not in step or len(cycle[step['waypoint']])]
+        while True:
+            if chunk is None:
+                chunk = {'waypoints': [list(position)], 'ids': {_waypoint_key(position): 0},
+                         'timeline': [{"type": "home", "waypoint_id": 0}], 'cycles': 0}
+            new_keys = {_waypoint_key(cycle[step['waypoint']]) for step in cycle_steps if 'waypoint' in step}
+            new_keys -= set(chunk['ids'])
+            if (len(chunk['waypoints']) + len(new_keys) <= max_waypoints and
+                    len(chunk['timeline']) + len(cycle_steps) <= max_timeline and
+                    (max_cycles is None or chunk['cycles'] < max_cycles)):
+                break
+            if len(chunk['timeline']) == 1:
+                raise Exception('Cycle {} does not fit in a single toolpath of {} waypoints and {} timeline steps'
+                                .format(cycle_index, max_waypoints, max_timeline))
+            toolpaths.append(_toolpath(metadata, chunk))
+            chunk = None
+        for step in cycle_steps:
+            step = copy.deepcopy(step)
+            if 'waypoint' in step:
+                joints = cycle[step.pop('waypoint')]
+                key = _waypoint_key(joints)
+                if key not in chunk['ids']:
+                    chunk['ids'][key] = len(chunk['waypoints'])
+                    chunk['waypoints'].append(list(joints))
+                step['waypoint_id'] = chunk['ids'][key]
+                position = joints
+            chunk['timeline'].append(step)
+        chunk['cycles'] += 1
+    if chunk is not None:
+        toolpaths.append(_toolpath(metadata, chunk))
+    return toolpaths
+
+
+def toolpath_cycle_counts(cycle_timeline, cycles, toolpaths):
+    """Number of cycles in each of the toolpaths compiled by compile_toolpaths() from cycle_timeline and cycles"""
+    cycle_steps = [step for step in cycle_timeline if 'waypoint' not in step or len(cycles[0][step['waypoint']])]
+    return [(len(toolpath['timeline']) - 1) // len(cycle_steps) for toolpath in toolpaths]
+
+
+def _toolpath(metadata, chunk):
+    metadata = copy.deepcopy(metadata)
+    metadata['next_label_id'] = len(chunk['waypoints']) + 1
+    waypoints = [{"label_id": index + 1, "joints": joints} for index, joints in enumerate(chunk['waypoints'])]
+    return {"metadata": metadata, "waypoints": waypoints, "timeline": chunk['timeline']}
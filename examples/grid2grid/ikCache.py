@@ -0,0 +1,90 @@
+import os
+import hashlib
+import numpy as np
+
+
+class IkCache:
+    """Persistent cache of solved IK joint angles, stored as a compact .npz file.
+    Every entry is keyed by a hash of its IK inputs (position, pickup angle and guess) and of the solver
+    (kinematics backend, and chain of the local model), so only the entries whose inputs changed are recomputed."""
+    VERSION = 2
+    KEY_SIZE = 20  # sha1 digest [bytes]
+    GUESS_STRATEGIES = ('fixed', 'neighbour')
+
+    def __init__(self, cache_file, rebuild=False):
+        self.cache_file = cache_file
+        self._joints = {}
+        self._used = set()
+        self._dirty = False
+        if not rebuild:
+            self.load()
+
+    @staticmethod
+    def solver_hash(kinematics):
+        """Hash of the solver of a Kinematics: its backend and, for the local model, its kinematic chain"""
+        solver = [kinematics.backend]
+        if kinematics.backend != 'remote':
+            solver += [kinematics.chain.axes.tolist(), kinematics.chain.points.tolist(),
+                       kinematics.chain.tool_plate.tolist()]
+        return hashlib.sha1(repr(solver).encode('utf-8')).digest()
+
+    @staticmethod
+    def entry_keys(guess, theta, positions, guess_strategy='fixed', solver=b''):
+        """Hashes of the IK inputs of each position in the (N, 3) positions array [m], and of the solver_hash().
+        With the 'neighbour' guess strategy the seed of a slot is not part of its key: a grid is reused only if
+        none of its slots changed"""
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        inputs = np.empty((positions.shape[0], 5 + len(guess)), dtype=np.float64)
+        inputs[:, :3] = positions
+        inputs[:, 3] = theta
+        inputs[:, 4] = IkCache.GUESS_STRATEGIES.index(guess_strategy)
+        inputs[:, 5:] = guess
+        # Round to sub-micrometre precision so that float noise does not invalidate entries
+        inputs = np.round(inputs, 9) + 0.0
+        return [hashlib.sha1(solver + row.tobytes()).digest() for row in inputs]
+
+    def lookup(self, keys):
+        """Returns the cached joints for each key, None for the missing ones"""
+        self._used.update(keys)
+        return [self._joints.get(key) for key in keys]
+
+    def store(self, keys, joints):
+        for key, joints_key in zip(keys, joints):
+            # Slots that were not planned, i.e. assigned to another robot
+            if joints_key is None:
+                continue
+            joints_key = [float(q) for q in joints_key]
+            if self._joints.get(key) != joints_key:
+                self._joints[key] = joints_key
+                self._dirty = True
+            self._used.add(key)
+
+    def load(self):
+        """Loads and validates the cache file. An invalid or outdated file is ignored"""
+        if not os.path.isfile(self.cache_file):
+            return
+        try:
+            with np.load(self.cache_file, allow_pickle=False) as data:
+                if int(data['version']) != self.VERSION:
+                    raise ValueError('cache version {} is not supported'.format(int(data['version'])))
+                keys = data['keys']
+                joints = data['joints']
+                if keys.ndim != 2 or keys.shape[1] != self.KEY_SIZE or joints.shape[0] != keys.shape[0]:
+                    raise ValueError('inconsistent cache arrays')
+        except (OSError, KeyError, ValueError) as e:
+            print('Ignoring IK cache {}: {}'.format(self.cache_file, e))
+            return
+        self._joints = {key.tobytes(): joints_key for key, joints_key in zip(keys, joints.tolist())}
+
+    def save(self):
+        """Writes the entries used in this session to the cache file, if anything changed"""
+        if not self._dirty:
+            return
+        keys = [key for key in self._joints if key in self._used]
+        joints = np.array([self._joints[key] for key in keys], dtype=np.float64).reshape(len(keys), -1)
+        keys_array = np.frombuffer(b''.join(keys), dtype=np.uint8).reshape(len(keys), self.KEY_SIZE)
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez_compressed(f, version=self.VERSION, keys=keys_array, joints=joints)
+        os.replace(tmp_file, self.cache_file)
+        self._dirty = False
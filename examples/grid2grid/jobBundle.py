@@ -0,0 +1,125 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import numpy as np
+
+
+# Configuration entries that do not change the planned job: the connection to Eva and the run-time settings
+RUNTIME_TAGS = ('metrics', 'lock', 'plot', 'ik_cache', 'cycle_time', 'bundle', 'journal')
+
+
+def config_checksum(config, *extra):
+    """Hex sha256 of the configuration entries a job is planned from, and of any extra JSON-serialisable inputs of
+    the plan (i.e. the cycle timeline)"""
+    plan = {tag: value for tag, value in config.items() if tag not in RUNTIME_TAGS}
+    plan['EVA'] = {key: value for key, value in config['EVA'].items() if key != 'comm'}
+    payload = json.dumps([plan] + list(extra), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class JobBundle:
+    """A planned grid2grid job in a single binary file: the grid coordinates, the joints of every slot, the slot
+    ordering, the waypoints of every cycle and the compiled toolpaths. The file starts with a fixed header (magic,
+    format version, index size), followed by a JSON index (checksum of the configuration, array names, dtypes,
+    shapes and offsets) and by the raw arrays, aligned to ALIGNMENT bytes. Opening a bundle memory-maps it: the
+    arrays are read-only views of the file, read from disk only when used"""
+    MAGIC = b'EVAJOB\x00\x00'
+    VERSION = 1
+    ALIGNMENT = 64
+    _HEADER = struct.Struct('<8sII')  # magic, version, index size [bytes]
+
+    def __init__(self, bundle_file, checksum=None):
+        """checksum : config_checksum() of the current configuration. A bundle compiled from another configuration
+        is rejected"""
+        self.bundle_file = bundle_file
+        with open(bundle_file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._mmap) < self._HEADER.size:
+                raise ValueError('truncated header')
+            magic, version, index_size = self._HEADER.unpack_from(self._mmap, 0)
+            if magic != self.MAGIC:
+                raise ValueError('not a job bundle')
+            if version != self.VERSION:
+                raise ValueError('bundle version {} is not supported'.format(version))
+            self.index = json.loads(bytes(self._mmap[self._HEADER.size:self._HEADER.size + index_size]))
+            if checksum is not None and self.index['checksum'] != checksum:
+                raise ValueError('compiled from another configuration, compile it again')
+            for name, entry in self.index['arrays'].items():
+                nbytes = np.dtype(entry['dtype']).itemsize * int(np.prod(entry['shape']))
+                if entry['offset'] + nbytes > len(self._mmap):
+                    raise ValueError('truncated array {}'.format(name))
+        except (ValueError, KeyError) as e:
+            self.close()
+            raise ValueError('Invalid job bundle {}: {}'.format(bundle_file, e))
+
+    @classmethod
+    def write(cls, bundle_file, checksum, arrays, **info):
+        """Writes a bundle of named arrays, and of JSON-serialisable info, replacing bundle_file atomically"""
+        arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+        entries = {name: {'dtype': array.dtype.str, 'shape': list(array.shape)} for name, array in arrays.items()}
+        index = dict(info, checksum=checksum, arrays=entries)
+        # The arrays follow the index, whose size depends on the offsets it holds: iterate until they agree
+        data_start = 0
+        while True:
+            for entry, offset in zip(entries.values(), _aligned_offsets(arrays.values(), cls.ALIGNMENT)):
+                entry['offset'] = data_start + offset
+            index_bytes = json.dumps(index).encode('utf-8')
+            start = _align(cls._HEADER.size + len(index_bytes), cls.ALIGNMENT)
+            if start == data_start:
+                break
+            data_start = start
+        tmp_file = bundle_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(cls._HEADER.pack(cls.MAGIC, cls.VERSION, len(index_bytes)))
+            f.write(index_bytes)
+            for name, array in arrays.items():
+                f.seek(entries[name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(max([data_start] + [entry['offset'] + array.nbytes
+                                           for entry, array in zip(entries.values(), arrays.values())]))
+        os.replace(tmp_file, bundle_file)
+
+    def array(self, name):
+        """Read-only view of an array of the bundle"""
+        entry = self.index['arrays'][name]
+        dtype = np.dtype(entry['dtype'])
+        return np.frombuffer(self._mmap, dtype=dtype, count=int(np.prod(entry['shape'])),
+                             offset=entry['offset']).reshape(entry['shape'])
+
+    def cycles(self):
+        """Waypoints of every cycle, as built by main.build_cycles(): waypoint name -> joints [rad]"""
+        names = self.index['waypoints']
+        used = self.array('waypoints_used')
+        joints = self.array('cycle_joints').tolist()
+        return [{name: joints_cycle[index] if used[index] else [] for index, name in enumerate(names)}
+                for joints_cycle in joints]
+
+    def toolpaths(self):
+        """Compiled toolpaths, empty in 'per_slot' toolpath mode"""
+        payload = self.array('toolpaths')
+        bounds = self.array('toolpath_bounds').tolist()
+        return [json.loads(payload[start:end].tobytes()) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def _align(size, alignment):
+    return -(-size // alignment) * alignment
+
+
+def _aligned_offsets(arrays, alignment):
+    offset = 0
+    for array in arrays:
+        yield offset
+        offset += _align(array.nbytes, alignment)
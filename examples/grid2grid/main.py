@@ -1,71 +1,379 @@
+import sys
+import json
+import argparse
+import threading
+import numpy as np
 from evasdk import Eva
-from evaUtilities import EvaGrids
+from evaUtilities import EvaGrids, create_grid
+from multiRobot import robot_config, partition_cycles, Progress, run_workers
+from gridToolpaths import compile_toolpaths, toolpath_cycle_counts, transit_timeline
+from jobBundle import JobBundle, config_checksum
+from progressJournal import ProgressJournal
+from toolpathTemplate import ToolpathTemplate, use_toolpath
+from slotOrdering import plan_cycles
+from cycleTime import CycleTimeEstimator
+from evaMetrics import Metrics, instrument
+from evaLockLease import LockLease, lock_session
 from config.config_manager import load_use_case_config
 
 
+# Timeline of one pick-and-place cycle, from the hover position of the pick slot to the hover position of the drop
+# slot. Trajectory steps reference the waypoints of the cycle by name: home, pick_hover, pick, operation_A/B/C,
+# drop_hover, drop, and pick_safe/drop_safe with the 'safe_plane' transit policy. The transit steps between cycles
+# are added by transit_timeline(). As in every Eva toolpath, wait durations are in milliseconds
+CYCLE_TIMELINE = [
+    {"type": "output-set", "io": {"location": "base", "type": "digital", "index": 0}, "value": True},
+    {"type": "trajectory", "trajectory": "linear", "waypoint": "pick"},
+    {"type": "wait", "condition": {"type": "time", "duration": 200}},
+    {"type": "trajectory", "trajectory": "joint_space", "waypoint": "pick_hover"},
+    {"type": "trajectory", "trajectory": "joint_space", "waypoint": "operation_A"},
+    {"type": "trajectory", "trajectory": "joint_space", "waypoint": "drop_hover"},
+    {"type": "trajectory", "trajectory": "linear", "waypoint": "drop"},
+    {"type": "output-set", "io": {"location": "base", "type": "digital", "index": 0}, "value": False},
+    {"type": "trajectory", "trajectory": "linear", "waypoint": "drop_hover"},
+]
+
+
+def toolpath_metadata(config):
+    return {
+        "version": 2,
+        "default_max_speed": 0.1,
+        "payload": config['EVA']['end_effector']['payload'],
+        "analog_modes": {"i0": "voltage", "i1": "voltage", "o0": "voltage", "o1": "voltage"}
+    }
+
+
+def cycle_timeline(config):
+    """Timeline of a whole cycle, with the transit steps of the policy set in the optional 'transit' entry"""
+    return transit_timeline(CYCLE_TIMELINE, config.get('transit', {}).get('policy', 'home'))
+
+
+def plan_slot_order(config, joints):
+    """Order of the cycles and drop slot of each pick, from the optional 'ordering' entry of the configuration.
+    Prints the estimated joint-space travel time of the plan against row-major order"""
+    ordering_config = config.get('ordering', {})
+    grid_pick, grid_drop = config['grids']['names']
+    shape = (abs(config['grids']['row'][grid_pick]), abs(config['grids']['col'][grid_pick]))
+    # When every cycle starts and ends at home, only the pick-to-drop assignment changes the travel
+    home = config['EVA']['home'] if config.get('transit', {}).get('policy', 'home') == 'home' else None
+    plan = plan_cycles(joints[grid_pick]['hover'], joints[grid_drop]['hover'],
+                       ordering_config.get('joint_speeds', [1.0] * 6), ordering_config.get('strategy', 'row_major'),
+                       ordering_config.get('assignment', 'by_index'), shape, home)
+    saving = plan['travel_row_major'] - plan['travel']
+    print('Estimated travel: {:.1f} s ({:.1f} s in row-major order, {:.1f}% saved)'.format(
+        plan['travel'], plan['travel_row_major'],
+        100 * saving / plan['travel_row_major'] if plan['travel_row_major'] else 0.0))
+    return plan
+
+
+def estimate_pallet(config, cycles):
+    """Prints the estimated time of each cycle and of the whole pallet, without running it"""
+    estimator = CycleTimeEstimator.from_config(config)
+    times, total = estimator.pallet(toolpath_metadata(config), cycle_timeline(config), cycles, config['EVA']['home'])
+    if len(times):
+        print('Estimated cycle time: {:.2f} s mean, {:.2f} s max; pallet of {} cycles: {:.1f} s ({:.0f} picks/hour)'
+              .format(times.mean(), times.max(), len(times), total, 3600 * len(times) / total if total else 0.0))
+    return times, total
+
+
+def build_cycles(config, joints, order=None, drops=None):
+    """Waypoints of every pick-and-place cycle: pick slot order[i] of the first grid is dropped in slot drops[i] of
+    the second, by default pick slot i is dropped in slot i"""
+    grid_pick, grid_drop = config['grids']['names']
+    if order is None:
+        order = drops = range(len(joints[grid_pick]['pick']))
+    cycles = []
+    for counter, drop in zip(order, drops):
+        cycles.append({
+            "home": config['EVA']['home'],
+            "pick_hover": joints[grid_pick]['hover'][counter],
+            "pick": joints[grid_pick]['pick'][counter],
+            # USER DEFINED WAY-POINTS
+            "operation_A": [],
+            "operation_B": [],
+            "operation_C": [],
+            "drop_hover": joints[grid_drop]['hover'][drop],
+            "drop": joints[grid_drop]['pick'][drop],
+        })
+        # Positions on the safe plane above both slots, with the 'safe_plane' transit policy
+        if 'safe' in joints[grid_pick]:
+            cycles[-1].update(pick_safe=joints[grid_pick]['safe'][counter], drop_safe=joints[grid_drop]['safe'][drop])
+    return cycles
+
+
+def run_per_slot(eva, config, cycles, on_run=None, stop=None):
+    """Uploads and runs one toolpath per pick-and-place cycle, each starting where the previous one ended, and goes
+    back home after the last one. on_run is called after each toolpath run. Setting the stop event ends the run
+    after the current cycle"""
+    # Metadata and timeline are built once, only the waypoints are patched for each cycle. Steps whose waypoint has
+    # no joints (i.e. unused user-defined operations) are skipped
+    steps = [step for step in cycle_timeline(config) if 'waypoint' not in step or len(cycles[0][step['waypoint']])]
+    waypoint_names = ['start']
+    for step in steps:
+        if 'waypoint' in step and step['waypoint'] not in waypoint_names:
+            waypoint_names.append(step['waypoint'])
+    timeline = [{"type": "home", "waypoint_id": 0}]
+    for step in steps:
+        step = dict(step)
+        if 'waypoint' in step:
+            step['waypoint_id'] = waypoint_names.index(step.pop('waypoint'))
+        timeline.append(step)
+    tool_path_grid_to_grid = ToolpathTemplate(toolpath_metadata(config), waypoint_names, timeline)
+
+    position = config['EVA']['home']
+    for cycle in cycles:
+        if stop is not None and stop.is_set():
+            break
+        tool_path_grid_to_grid.set_joints(start=position, **{name: cycle[name] for name in waypoint_names[1:]})
+        # With a LockLease, the lock is held across the cycles instead of being acquired for each of them
+        with lock_session(eva):
+            eva.control_wait_for_ready()
+            tool_path_grid_to_grid.use(eva)
+            eva.control_run(loop=1, mode="automatic")
+        position = cycle[waypoint_names[timeline[-1]['waypoint_id']]]
+        if on_run is not None:
+            on_run()
+    if position != config['EVA']['home']:
+        with lock_session(eva):
+            eva.control_go_to(config['EVA']['home'])
+
+
+def run_compiled(eva, toolpaths, on_run=None, home=None, stop=None):
+    """Runs a whole grid-to-grid pallet as a handful of multi-cycle toolpaths, and goes back to home [rad] after the
+    last one if it does not end there. on_run is called after each toolpath run. Setting the stop event ends the
+    run after the current toolpath"""
+    with lock_session(eva):
+        for tool_path_grid_to_grid in toolpaths:
+            if stop is not None and stop.is_set():
+                break
+            eva.control_wait_for_ready()
+            use_toolpath(eva, tool_path_grid_to_grid)
+            eva.control_run(loop=1, mode="automatic")
+            if on_run is not None:
+                on_run()
+        last_toolpath = toolpaths[-1]
+        end = last_toolpath['waypoints'][last_toolpath['timeline'][-1]['waypoint_id']]['joints']
+        if home is not None and end != list(home):
+            eva.control_go_to(home)
+
+
+def plan_job(eva, config, show_plot=True, confirm=True, slots=None):
+    """Solves the joints of the grids and builds the cycles of a pallet, and its toolpaths in 'compiled' mode
+    (an empty list otherwise). slots : cycles of the pallet to plan, pick slot i to drop slot i, i.e. the share of
+    one robot of a multi-robot job. By default all the cycles are planned, in the configured order.
+    Returns a dictionary with the joints of the grids, the pick slot ('order') and drop slot ('drops') of each
+    cycle, the cycles and the toolpaths"""
+    eva_box = EvaGrids(eva, config, show_plot=show_plot)
+    names = config['grids']['names']
+    if slots is None:
+        joints = eva_box.get_grid_points(names, confirm)
+        plan = plan_slot_order(config, joints)
+        order, drops = plan['order'], plan['drops']
+    else:
+        joints = eva_box.get_grid_points(names, confirm, {grid_iter: slots for grid_iter in names})
+        order = drops = slots
+    cycles = build_cycles(config, joints, order, drops)
+    estimate_pallet(config, cycles)
+
+    toolpaths = compile_pallet(config, cycles)
+    if toolpaths:
+        print('Compiled {} cycles into {} toolpaths'.format(len(cycles), len(toolpaths)))
+    return {'joints': joints, 'order': order, 'drops': drops, 'cycles': cycles, 'toolpaths': toolpaths}
+
+
+def compile_pallet(config, cycles):
+    """'compiled' mode: all the cycles are merged into as few toolpaths as the size limits allow, starting from home.
+    Returns an empty list in 'per_slot' mode"""
+    toolpath_config = config.get('toolpath', {})
+    if toolpath_config.get('mode', 'per_slot') != 'compiled':
+        return []
+    return compile_toolpaths(toolpath_metadata(config), cycle_timeline(config), cycles, config['EVA']['home'],
+                             toolpath_config['max_waypoints'], toolpath_config['max_timeline'],
+                             toolpath_config.get('max_cycles'))
+
+
+def plan_pallet(eva, config, show_plot=True, confirm=True, slots=None):
+    """Cycles and toolpaths of a pallet, planned by plan_job()"""
+    job = plan_job(eva, config, show_plot, confirm, slots)
+    return job['cycles'], job['toolpaths']
+
+
+def bundle_checksum(config):
+    """Checksum of the inputs of a job bundle: the configuration, the cycle timeline and the toolpath metadata"""
+    return config_checksum(config, cycle_timeline(config), toolpath_metadata(config))
+
+
+def compile_bundle(eva, config, bundle_file, show_plot=True):
+    """Plans the pallet and writes the grids, the joints of their slots, the slot ordering, the cycles and the
+    compiled toolpaths to a job bundle (see jobBundle), so that 'run' starts moving without planning"""
+    if config.get('robots'):
+        raise Exception('Job bundles are planned for a single robot: empty the robots list to compile one')
+    job = plan_job(eva, config, show_plot=show_plot, confirm=False)
+    arrays = {'order': np.asarray(job['order'], dtype=np.int64), 'drops': np.asarray(job['drops'], dtype=np.int64)}
+    for grid_iter in config['grids']['names']:
+        arrays['grid_' + grid_iter] = create_grid(config, grid_iter)[0]
+        for pose, joints in job['joints'][grid_iter].items():
+            arrays['joints_{}_{}'.format(grid_iter, pose)] = np.array(joints, dtype=np.float64).reshape(-1, 6)
+    # Joints of the waypoints of every cycle; unused waypoints (i.e. user-defined operations) are left at zero
+    names = list(job['cycles'][0])
+    used = np.array([len(job['cycles'][0][name]) > 0 for name in names])
+    cycle_joints = np.zeros((len(job['cycles']), len(names), 6))
+    for index, cycle in enumerate(job['cycles']):
+        cycle_joints[index, used] = [cycle[name] for name, use in zip(names, used) if use]
+    arrays.update(cycle_joints=cycle_joints, waypoints_used=used)
+    # Serialised toolpaths, one after the other, and their bounds in the byte array
+    payloads = [json.dumps(toolpath, separators=(',', ':')).encode('utf-8') for toolpath in job['toolpaths']]
+    arrays['toolpaths'] = np.frombuffer(b''.join(payloads), dtype=np.uint8)
+    arrays['toolpath_bounds'] = np.cumsum([0] + [len(payload) for payload in payloads], dtype=np.int64)
+    JobBundle.write(bundle_file, bundle_checksum(config), arrays, waypoints=names, grids=config['grids']['names'])
+    print('Job bundle of {} cycles and {} toolpaths written to {}'.format(len(job['cycles']), len(job['toolpaths']),
+                                                                         bundle_file))
+
+
+def load_bundle(config, bundle_file):
+    """Cycles and toolpaths of a job bundle. The bundle is rejected if it was compiled from another
+    configuration"""
+    with JobBundle(bundle_file, bundle_checksum(config)) as bundle:
+        return bundle.cycles(), bundle.toolpaths()
+
+
+def run_pallet(eva, config, cycles, toolpaths, on_cycles=None, stop=None, start=0):
+    """Runs the cycles of a pallet, as its compiled toolpaths if there are any.
+    on_cycles is called with the number of cycles done after each toolpath run.
+    start : first cycle to run, i.e. when resuming an interrupted pallet; the compiled toolpaths of the remaining
+    cycles are compiled again"""
+    if toolpaths:
+        if start:
+            toolpaths = compile_pallet(config, cycles[start:])
+        on_run = None
+        if on_cycles is not None:
+            counts = iter(toolpath_cycle_counts(cycle_timeline(config), cycles, toolpaths))
+            on_run = lambda: on_cycles(next(counts))
+        run_compiled(eva, toolpaths, on_run, config['EVA']['home'], stop)
+    else:
+        run_per_slot(eva, config, cycles[start:], None if on_cycles is None else lambda: on_cycles(1), stop)
+
+
+def run_robots(config, connect, pallets=None, stop=None, on_cycles=None, confirm=True):
+    """Splits the pallet between the robots of the 'robots' list of the configuration (see multiRobot), each robot
+    planning and running its share in its own thread. Returns the Progress of the job.
+    connect : function returning the Eva of an entry of the 'robots' list, i.e. Eva(robot['host'], robot['token'])
+    pallets : number of pallets to run, None to run until stop is set
+    stop : event stopping all the robots after their current cycle, also set when one of them fails
+    on_cycles : called with the number of cycles done after each toolpath run, from the robot threads"""
+    robots = config['robots']
+    configs = [robot_config(config, robot) for robot in robots]
+    shares = partition_cycles(configs, toolpath_metadata(config)['default_max_speed'])
+    for robot, share in zip(robots, shares):
+        print('Robot {}: {} cycles'.format(robot['name'], len(share)))
+    if confirm and 'yes' not in input('Proceed (this will move {} robots)? yes/no\n'.format(len(robots))):
+        raise Exception('Script aborted by user')
+    progress = Progress({robot['name']: len(share) * pallets if pallets is not None else None
+                         for robot, share in zip(robots, shares) if share})
+    stop = threading.Event() if stop is None else stop
+    lock_config = config.get('lock', {})
+
+    def count(name, cycles):
+        progress.update(name, cycles)
+        if on_cycles is not None:
+            on_cycles(cycles)
+
+    def worker(robot, config_robot, share):
+        def run(stop):
+            eva = connect(robot)
+            with LockLease(eva, lock_config.get('idle_timeout', 5.0), lock_config.get('renew_period', 10.0)):
+                cycles, toolpaths = plan_pallet(eva, config_robot, show_plot=False, confirm=False, slots=share)
+                with lock_session(eva):
+                    eva.control_go_to(config_robot['EVA']['home'])
+                pallet = 0
+                while not stop.is_set() and (pallets is None or pallet < pallets):
+                    run_pallet(eva, config_robot, cycles, toolpaths, lambda done: count(robot['name'], done), stop)
+                    pallet += 1
+        return run
+
+    run_workers([worker(robot, config_robot, share) for robot, config_robot, share in zip(robots, configs, shares)
+                 if share], stop)
+    return progress
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Grid-to-grid pick and place. Without a command, the pallet is '
+                                                 'planned and then run')
+    parser.add_argument('command', nargs='?', choices=('compile', 'run'),
+                        help="'compile': plan the pallet into the job bundle of the configuration, 'run': run the "
+                             "job bundle without planning")
+    args = parser.parse_args()
+
     # Load use-case parameters
     config = load_use_case_config()
 
     # Connection to robot
     host = config['EVA']['comm']['host']
     token = config['EVA']['comm']['token']
-    eva = Eva(host, token)
+    # Per-phase timings of the requests to Eva, exported periodically when enabled
+    metrics = Metrics.from_config(config)
 
-    # Compute grid points and robot joints
-    eva_box = EvaGrids(eva, config, show_plot=True)
-    joints = eva_box.get_grid_points(config['grids']['names'])
+    # Several robots: the pallet is split between them, each one planned and run by its own thread
+    if config.get('robots') and args.command is None:
+        try:
+            run_robots(config, lambda robot: instrument(Eva(robot['host'], robot['token']), metrics),
+                       on_cycles=lambda cycles: metrics.count('picks', cycles))
+        finally:
+            metrics.export()
+        sys.exit()
 
-    # Go home before starting
-    with eva.lock():
-        eva.control_go_to(config['EVA']['home'])
+    eva = instrument(Eva(host, token), metrics)
+    # Eva's lock is acquired once, renewed while in use and released after idle_timeout without requests
+    lock_config = config.get('lock', {})
+    lease = LockLease(eva, lock_config.get('idle_timeout', 5.0), lock_config.get('renew_period', 10.0))
+    # The lease is released and the last metrics are exported on exit, i.e. on Ctrl+C or on an error
+    try:
+        with lease:
+            bundle_file = config.get('bundle', {}).get('file', 'config/job_bundle.bin')
+            if args.command == 'compile':
+                compile_bundle(eva, config, bundle_file)
+                sys.exit()
+            if args.command == 'run':
+                # Planned by 'compile': the cycles and toolpaths are read from the bundle, nothing is planned
+                cycles, toolpaths = load_bundle(config, bundle_file)
+            else:
+                # Compute grid points and robot joints, and the cycles of the pallet
+                cycles, toolpaths = plan_pallet(eva, config)
 
-    while True:
-        for counter in range(len(joints[(config['grids']['names'][0])]['pick'])):
-            joints_home = config['EVA']['home']
-            joints_pick = joints[config['grids']['names'][0]]['pick'][counter]
-            joints_drop = joints[config['grids']['names'][1]]['pick'][counter]
-            joints_pick_hover = joints[config['grids']['names'][0]]['hover'][counter]
-            joints_drop_hover = joints[config['grids']['names'][1]]['hover'][counter]
+            # Progress of the job, resumed at the first unfinished cycle after a crash, an e-stop or a restart
+            journal = ProgressJournal.from_config(config, bundle_checksum(config))
+            pallet, start = 0, 0
+            if journal is not None:
+                pallet, start = journal.pallet, journal.done
+                if start >= len(cycles):
+                    pallet, start = pallet + 1, 0
+                    journal.record(pallet, 0)
+                if start:
+                    print('Resuming pallet {} at cycle {} of {}'.format(pallet, start, len(cycles)))
+                if start and toolpaths:
+                    # The journal records completed toolpaths: an interrupted one runs again from its first cycle
+                    resumed = toolpath_cycle_counts(cycle_timeline(config), cycles,
+                                                    compile_pallet(config, cycles[start:]))[0]
+                    print('Compiled toolpaths resume from their first cycle: the objects of cycles {} to {} may '
+                          'already have been moved, check their slots'.format(start, start + resumed - 1))
 
-            # USER DEFINED WAY-POINTS
-            joints_operation_A = []
-            joints_operation_B = []
-            joints_operation_C = []
-
-            tool_path_grid_to_grid = {
-                "metadata": {
-                    "version": 2,
-                    "default_max_speed": 0.1,
-                    "next_label_id": 7,
-                    "payload": config['EVA']['end_effector']['payload'],
-                    "analog_modes": {"i0": "voltage", "i1": "voltage", "o0": "voltage", "o1": "voltage"}
-                    },
-                "waypoints": [
-                    {"label_id": 1, "joints": joints_home},
-                    {"label_id": 2, "joints": joints_pick_hover},
-                    {"label_id": 3, "joints": joints_pick},
-                    {"label_id": 4, "joints": joints_operation_A},
-                    {"label_id": 5, "joints": joints_drop_hover},
-                    {"label_id": 6, "joints": joints_drop},
-                ],
-                "timeline": [
-                    {"type": "home", "waypoint_id": 0},
-                    {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 1},
-                    {"type": "output-set", "io": {"location": "base", "type": "digital", "index": 0}, "value": True},
-                    {"type": "trajectory", "trajectory": "linear", "waypoint_id": 2},
-                    {"type": "wait", "condition": {"type": "time", "duration": 0.2}},
-                    {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 1},
-                    {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 3},
-                    {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 4},
-                    {"type": "trajectory", "trajectory": "linear", "waypoint_id": 5},
-                    {"type": "output-set", "io": {"location": "base", "type": "digital", "index": 0}, "value": False},
-                    {"type": "trajectory", "trajectory": "linear", "waypoint_id": 4},
-                    {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 0},
-                ]
-            }
-
-            with eva.lock():
-                eva.control_wait_for_ready()
-                eva.toolpaths_use(tool_path_grid_to_grid)
-                eva.control_run(loop=1, mode="automatic")
+            def count_cycles(cycles_done):
+                metrics.count('picks', cycles_done)
+                if journal is not None:
+                    journal.record(pallet, journal.done + cycles_done)
+
+            # Go home before starting
+            with lock_session(eva):
+                eva.control_go_to(config['EVA']['home'])
+
+            try:
+                while True:
+                    run_pallet(eva, config, cycles, toolpaths, on_cycles=count_cycles, start=start)
+                    pallet, start = pallet + 1, 0
+                    if journal is not None:
+                        journal.record(pallet, 0)
+            finally:
+                if journal is not None:
+                    journal.close()
+    finally:
+        metrics.export()
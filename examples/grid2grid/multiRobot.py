@@ -0,0 +1,115 @@
+import copy
+import threading
+import numpy as np
+from evaUtilities import create_grid
+
+
+def robot_config(config, robot):
+    """Use-case configuration of one robot of the 'robots' list: its connection, optional home and guesses, and the
+    grids in its own frame. robot['base'] is the pose of the robot in the frame the grids are defined in:
+    x [mm], y [mm], angle [deg]"""
+    config = copy.deepcopy(config)
+    config.pop('robots', None)
+    config['EVA']['comm'] = {'host': robot['host'], 'token': robot['token']}
+    if 'home' in robot:
+        config['EVA']['home'] = robot['home']
+    base_x, base_y, base_angle = robot.get('base', [0, 0, 0])
+    cos, sin = np.cos(np.deg2rad(base_angle)), np.sin(np.deg2rad(base_angle))
+    grids = config['grids']
+    for grid_iter in grids['names']:
+        dx, dy = grids['x0'][grid_iter] - base_x, grids['y0'][grid_iter] - base_y
+        grids['x0'][grid_iter] = float(cos * dx + sin * dy)
+        grids['y0'][grid_iter] = float(-sin * dx + cos * dy)
+        grids['angle'][grid_iter] -= base_angle
+        grids['angle_pickup'][grid_iter] -= base_angle
+        if 'guess' in robot:
+            grids['guess'][grid_iter] = robot['guess'][grid_iter]
+    # One IK cache per robot: the solutions depend on where the robot stands
+    if 'ik_cache' in config:
+        name, extension = config['ik_cache']['file'].rsplit('.', 1)
+        config['ik_cache']['file'] = '{}_{}.{}'.format(name, robot['name'], extension)
+    return config
+
+
+def reachable_slots(config, grid_iter):
+    """Slots of a grid within the reach of the robot of a configuration: radially beyond its base-plate and within
+    its work radius, in the xy plane [bool]"""
+    _, grid_points = create_grid(config, grid_iter)
+    radius = np.linalg.norm(grid_points[:, :2], axis=1) / 1000
+    return (radius > config['EVA']['base_plate'] / 2) & (radius <= config['EVA']['work_radius'])
+
+
+def partition_cycles(configs, tool_speed):
+    """Splits the cycles of a pallet, pick slot i to drop slot i, between robots, balancing their estimated busy
+    time. configs is the configuration of each robot (robot_config()). A cycle can only go to a robot that reaches
+    both of its slots; its duration is estimated, before any IK, as the length of the tool path from the robot's
+    base to the pick slot, to the drop slot and back, at tool_speed [m/s].
+    Cycles with the fewest candidate robots and the longest durations are assigned first, each to the candidate that
+    would finish it earliest. Returns the sorted cycle indices of each robot"""
+    grid_pick, grid_drop = configs[0]['grids']['names']
+    durations, reach = [], []
+    for config in configs:
+        pick = create_grid(config, grid_pick)[1][:, :2] / 1000
+        drop = create_grid(config, grid_drop)[1][:, :2][:len(pick)] / 1000
+        reach.append(reachable_slots(config, grid_pick) & reachable_slots(config, grid_drop)[:len(pick)])
+        path = np.linalg.norm(pick, axis=1) + np.linalg.norm(drop - pick, axis=1) + np.linalg.norm(drop, axis=1)
+        durations.append(path / tool_speed)
+    durations, reach = np.array(durations), np.array(reach)
+    unreachable = np.flatnonzero(~reach.any(axis=0))
+    if len(unreachable):
+        raise Exception('Cycles {} are not reachable by any robot'.format(unreachable.tolist()))
+    busy = np.zeros(len(configs))
+    shares = [[] for _ in configs]
+    for cycle in np.lexsort((-durations.max(axis=0), reach.sum(axis=0))):
+        finish = np.where(reach[:, cycle], busy + durations[:, cycle], np.inf)
+        robot = int(np.argmin(finish))
+        busy[robot] = finish[robot]
+        shares[robot].append(int(cycle))
+    return [sorted(share) for share in shares]
+
+
+class Progress:
+    """Cycles done by each robot of a multi-robot job, reported by the worker threads and printed as a single line"""
+    def __init__(self, totals):
+        """totals : number of cycles of each robot, by name, None for robots running until stopped"""
+        self.totals = dict(totals)
+        self.done = {name: 0 for name in self.totals}
+        self._lock = threading.Lock()
+
+    def update(self, name, cycles=1):
+        with self._lock:
+            self.done[name] += cycles
+            print(str(self))
+
+    def __str__(self):
+        robots = ', '.join('{} {}'.format(name, self.done[name]) + ('' if total is None else '/{}'.format(total))
+                           for name, total in self.totals.items())
+        return 'Cycles: {} - total {}'.format(robots, sum(self.done.values()))
+
+
+def run_workers(workers, stop):
+    """Runs each worker, a function of the stop event, in its own thread. The first worker failure, or a
+    KeyboardInterrupt, sets stop so that the other workers stop too, and is raised once they all have"""
+    errors = []
+
+    def run(worker):
+        try:
+            worker(stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=run, args=(worker,), daemon=True) for worker in workers]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.1)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        raise
+    if errors:
+        raise errors[0]
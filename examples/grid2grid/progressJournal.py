@@ -0,0 +1,105 @@
+import os
+import time
+import zlib
+import struct
+
+
+class ProgressJournal:
+    """Append-only journal of the progress of a grid2grid job, to resume it where it stopped after a crash, an
+    e-stop or a restart. The file starts with a header (magic, format version, checksum of the plan) followed by
+    fixed-size records, one per completed toolpath run: pallet number, cycles done in the pallet, time, and the CRC32
+    of the record. Only the last valid record matters, so replaying the journal reads the end of the file only,
+    whatever its length; a record torn by a crash fails its CRC and is dropped.
+    Every record is written to the OS at once, so a crash of the program loses nothing; the records are fsync-ed to
+    disk in batches, every sync_every records or sync_period seconds, so a power loss can lose the last batch"""
+    MAGIC = b'EVAPRG\x00\x00'
+    VERSION = 1
+    _HEADER = struct.Struct('<8sI32s')  # magic, version, plan checksum (sha256)
+    _RECORD = struct.Struct('<IIdI')  # pallet, cycles done, time [s], CRC32 of the first 16 bytes
+    MAX_TORN = 16  # records checked backwards from the end of the file for a valid one
+
+    def __init__(self, journal_file, checksum, sync_every=10, sync_period=1.0):
+        """checksum : hex sha256 of the plan, i.e. main.bundle_checksum(). The progress of another plan is discarded"""
+        self.journal_file = journal_file
+        self.checksum = bytes.fromhex(checksum)
+        self.sync_every = max(1, sync_every)
+        self.sync_period = sync_period
+        self.pallet, self.done = 0, 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._file = open(journal_file, 'a+b', buffering=0)
+        self._replay()
+
+    @classmethod
+    def from_config(cls, config, checksum):
+        """Journal of the optional 'journal' entry of a use-case configuration, None when it is disabled"""
+        journal_config = config.get('journal', {})
+        if not journal_config.get('enabled', False):
+            return None
+        return cls(journal_config.get('file', 'config/progress_journal.bin'), checksum,
+                   journal_config.get('sync_every', 10), journal_config.get('sync_period', 1.0))
+
+    def _replay(self):
+        """Reads the last valid record, and truncates what follows it. An empty, foreign or outdated journal is
+        restarted with a new header"""
+        size = self._file.seek(0, os.SEEK_END)
+        header = b''
+        if size >= self._HEADER.size:
+            self._file.seek(0)
+            header = self._file.read(self._HEADER.size)
+        if header != self._HEADER.pack(self.MAGIC, self.VERSION, self.checksum):
+            if size:
+                print('Discarding progress journal {}: written for another plan'.format(self.journal_file))
+            self._restart()
+            return
+        count = (size - self._HEADER.size) // self._RECORD.size
+        for index in range(count - 1, max(count - self.MAX_TORN, 0) - 1, -1):
+            offset = self._HEADER.size + index * self._RECORD.size
+            self._file.seek(offset)
+            record = self._file.read(self._RECORD.size)
+            pallet, done, _, crc = self._RECORD.unpack(record)
+            if zlib.crc32(record[:-4]) == crc:
+                self.pallet, self.done = pallet, done
+                end = offset + self._RECORD.size
+                break
+        else:
+            if count:
+                print('Discarding progress journal {}: no valid record'.format(self.journal_file))
+            end = self._HEADER.size
+        if end != size:
+            self._file.truncate(end)
+            os.fsync(self._file.fileno())
+
+    def _restart(self):
+        self._file.truncate(0)
+        self._file.write(self._HEADER.pack(self.MAGIC, self.VERSION, self.checksum))
+        os.fsync(self._file.fileno())
+        self.pallet, self.done = 0, 0
+
+    def record(self, pallet, done):
+        """Appends the progress: done cycles of pallet completed"""
+        record = struct.pack('<IId', pallet, done, time.time())
+        self._file.write(record + struct.pack('<I', zlib.crc32(record)))
+        self.pallet, self.done = pallet, done
+        self._pending += 1
+        if self._pending >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_period:
+            self.sync()
+
+    def sync(self):
+        """Forces the records written so far to disk"""
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
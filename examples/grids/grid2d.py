@@ -1,44 +1,97 @@
-from typing import List, Tuple, NamedTuple
+from typing import Iterator, Tuple, NamedTuple, Union
+import os
+import sys
+
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from slotOrdering import COST_STRATEGIES, order_slots
 
 class XYPoint(NamedTuple):
-    x: int
-    y: int
+    x: float
+    y: float
 
 GridCorners = Tuple[XYPoint, XYPoint, XYPoint]
 
 class Grid2D:
     """
-    Grid2D is a iterable collection of XYPoints generated from a set of grid 
-    corner positions and a number of rows and columns
+    Grid2D is a random-access collection of XYPoints generated from a set of
+    grid corner positions and a number of rows and columns. The positions are
+    stored in a contiguous (N, 2) float64 array, column by column, and the grid
+    can be indexed, sliced and iterated any number of times.
     """
     def __init__(self, grid_corners: GridCorners, rows: int, columns: int):
-        self.__current_position: int = 0
-        self.__positions: List[XYPoint] = []
-
         x_start = grid_corners[0][0]
         x_end = grid_corners[1][0]
 
         y_start = grid_corners[1][1]
         y_end = grid_corners[2][1]
-        
-        column_step: float = (x_start - x_end) / (columns  - 1)
+
+        column_step: float = (x_start - x_end) / (columns - 1)
         row_step: float = (y_start - y_end) / (rows - 1)
 
-        for column in range(columns):
-            for row in range(rows):
-                x = x_start - (column_step * column)
-                y = y_start - (row_step * row)
-                self.__positions.append(XYPoint(x = x, y = y))
+        x = x_start - column_step * np.arange(columns, dtype=np.float64)
+        y = y_start - row_step * np.arange(rows, dtype=np.float64)
+
+        # Columns are the outer loop, rows the inner one: (column, row, xy) -> (N, xy)
+        positions = np.empty((columns, rows, 2), dtype=np.float64)
+        positions[:, :, 0] = x[:, np.newaxis]
+        positions[:, :, 1] = y[np.newaxis, :]
+        self.__positions: np.ndarray = positions.reshape(-1, 2)
+        self.__positions.flags.writeable = False
+        self.__shape = (columns, rows)
+
+
+    @classmethod
+    def from_points(cls, points: np.ndarray) -> 'Grid2D':
+        """
+        Build a Grid2D directly from an (N, 2) array of x, y positions, i.e. a
+        filtered or transformed copy of another grid's points.
+        """
+        positions = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+        positions.flags.writeable = False
+        grid = cls.__new__(cls)
+        grid.__positions = positions
+        grid.__shape = None
+        return grid
+
+
+    @property
+    def points(self) -> np.ndarray:
+        """
+        Read-only (N, 2) view of every grid position, without copying. Use it
+        to transform or filter all positions at once.
+        """
+        return self.__positions
+
+
+    def ordered(self, strategy: str = 'serpentine') -> 'Grid2D':
+        """
+        Copy of the grid visiting its positions in another order, to shorten the
+        travel between them: 'serpentine' (every other column reversed, only for
+        grids built from corners), 'nearest_neighbour' or 'two_opt' (shortest
+        path found over the xy distances), see slotOrdering.STRATEGIES.
+        """
+        if strategy == 'row_major':
+            return Grid2D.from_points(self.__positions)
+        # The (N, N) distance matrix is only built for the strategies that search it
+        cost = None
+        if strategy in COST_STRATEGIES:
+            cost = np.linalg.norm(self.__positions[:, np.newaxis] - self.__positions[np.newaxis], axis=2)
+        order = order_slots(cost, strategy, self.__shape)
+        return Grid2D.from_points(self.__positions[order])
+
+
+    def __len__(self) -> int:
+        return self.__positions.shape[0]
 
 
-    def __iter__(self):
-        return self
+    def __getitem__(self, index: Union[int, slice]) -> Union[XYPoint, 'Grid2D']:
+        if isinstance(index, slice):
+            return Grid2D.from_points(self.__positions[index])
+        x, y = self.__positions[index]
+        return XYPoint(x = float(x), y = float(y))
 
 
-    def __next__(self) -> XYPoint:
-        if self.__current_position > len(self.__positions) - 1:
-            raise StopIteration
-        else:
-            next_position = self.__positions[self.__current_position]
-            self.__current_position += 1
-            return next_position
+    def __iter__(self) -> Iterator[XYPoint]:
+        for x, y in self.__positions.tolist():
+            yield XYPoint(x = x, y = y)
@@ -1,8 +1,24 @@
 from typing import List, Tuple, NamedTuple
+import os
+import sys
 import time
 
 from evasdk import Eva
 from grid2d import Grid2D, GridCorners, XYPoint
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from evaKinematics import Kinematics
+from evaMetrics import Metrics, instrument
+from evaLockLease import lock_session
+from transitPolicy import check_policy, safe_height, transit_waypoints
+
+# IK backend: 'remote' (Eva) or 'checked' (NumPy model of the arm, cross-checked with Eva)
+KINEMATICS_BACKEND = 'remote'
+# Per-phase timings of the requests to Eva, i.e. 'metrics.jsonl' ('.prom' for a Prometheus text file), None to disable
+METRICS_FILE = None
+# Moves between grid positions: 'home' (back home in between), 'hover' or 'safe_plane' (through the positions
+# HOVER_HEIGHT above the grid, which is flat, so that both are the same)
+TRANSIT_POLICY = 'home'
+HOVER_HEIGHT = 0.1
 
 # Define the x and y coordinates for 3 corners of the grid
 grid_corners: GridCorners = [
@@ -10,38 +26,87 @@ grid_corners: GridCorners = [
     XYPoint(x = 0.35, y = 0),
     XYPoint(x = 0.35, y = 0.4),
 ]
-# Using the corners and an amount of rows and columns, make the Grid2D
-my_test_grid = Grid2D(grid_corners, rows = 4, columns = 4)
-
-# Connect to Eva
-host_ip = input("Please enter a Eva IP: ")
-token = input("Please enter a valid Eva token: ")
-eva = Eva(host_ip, token)
 
 # Set some default poses and a default orientation
 pose_home = [0.057526037, 0.7658633, -1.9867575, 0.026749607, -1.732109, -0.011505207]
 end_effector_orientation = {'w': 0.0, 'x': 0.0, 'y': 1.0, 'z': 0.0}
 grid_z_position: float = 0.4
 
-print("Waiting for Robot lock")
-with eva.lock():
-    print('Eva moving to home position')
-    eva.control_go_to(pose_home)
 
-    # For each grid position in the Grid2D
-    for grid_position in my_test_grid:
-        # Calculate joint angles for the grid position and goto those joint angles 
-        print('Eva going to grid position x={:f}, y={:f}'.format(grid_position.x, grid_position.y))
-        target_position = {'x': grid_position.x, 'y': grid_position.y, 'z': grid_z_position}
-        position_joint_angles = eva.calc_inverse_kinematics(pose_home, target_position, end_effector_orientation)
-        eva.control_go_to(position_joint_angles['ik']['joints'])
+def _check_ik(success, positions):
+    """Raises if the IK of any position failed, i.e. an unreachable position"""
+    if not success.all():
+        failed = [position for position, solved in zip(positions, success) if not solved]
+        raise Exception('IK failed for {} positions, i.e. {}: check the grid'.format(len(failed), failed[0]))
+
+
+def run_grid(eva, kinematics, grid: Grid2D, action_duration: float = 1, on_position=None,
+             transit_policy: str = 'home', hover_height: float = HOVER_HEIGHT):
+    """Moves Eva to each position of the grid, performing an action there. Between positions Eva moves as set by
+    transit_policy (see transitPolicy.POLICIES), and it goes back home at the end.
+    on_position is called after each grid position, i.e. to time the example"""
+    check_policy(transit_policy)
+    print("Waiting for Robot lock")
+    with lock_session(eva):
+        # Calculate joint angles for all the grid positions at once, before moving
+        grid_positions = [[grid_position.x, grid_position.y, grid_z_position] for grid_position in grid]
+        orientation = [end_effector_orientation[key] for key in 'wxyz']
+        success, grid_joint_angles, _ = kinematics.inverse(pose_home, grid_positions, orientation)
+        _check_ik(success, grid_positions)
+        grid_joint_angles = grid_joint_angles.tolist()
 
-        # Simulating an action with a sleep, i.e. this could be picking from a pallet
-        print('Eva performing action at grid waypoint')
-        time.sleep(1)
+        # Positions above the grid, at the height of the safe plane, where Eva moves between grid positions
+        hover_joint_angles = grid_joint_angles
+        if transit_policy != 'home':
+            z_hover = safe_height([grid_z_position], hover_height)
+            hover_positions = [[x, y, z_hover] for x, y, _ in grid_positions]
+            success, hover_joint_angles, _ = kinematics.inverse(grid_joint_angles, hover_positions, orientation)
+            _check_ik(success, hover_positions)
+            hover_joint_angles = hover_joint_angles.tolist()
 
-        # Move back to the home position between each grid waypoint
         print('Eva moving to home position')
         eva.control_go_to(pose_home)
+        current_joints = pose_home
+
+        # For each grid position in the Grid2D
+        for index, (grid_position, position_joint_angles) in enumerate(zip(grid, grid_joint_angles)):
+            # Goto the joint angles of the grid position, through the transit waypoints from the previous one
+            print('Eva going to grid position x={:f}, y={:f}'.format(grid_position.x, grid_position.y))
+            waypoints = [position_joint_angles]
+            if index:
+                waypoints = [hover_joint_angles[index - 1]] + transit_waypoints(
+                    transit_policy, hover_joint_angles[index], pose_home, hover_joint_angles[index - 1],
+                    hover_joint_angles[index]) + waypoints
+            for waypoint in waypoints:
+                if waypoint != current_joints:
+                    eva.control_go_to(waypoint)
+                    current_joints = waypoint
+
+            # Simulating an action with a sleep, i.e. this could be picking from a pallet
+            print('Eva performing action at grid waypoint')
+            time.sleep(action_duration)
+            if on_position is not None:
+                on_position()
+
+        print('Eva moving to home position')
+        eva.control_go_to(pose_home)
+
+    print("Grid movement complete, lock released")
+
+
+if __name__ == "__main__":
+    # Using the corners and an amount of rows and columns, make the Grid2D
+    my_test_grid = Grid2D(grid_corners, rows = 4, columns = 4)
+
+    # Connect to Eva
+    host_ip = input("Please enter a Eva IP: ")
+    token = input("Please enter a valid Eva token: ")
+    metrics = Metrics(METRICS_FILE is not None, METRICS_FILE,
+                      'prometheus' if str(METRICS_FILE).endswith('.prom') else 'jsonl')
+    eva = instrument(Eva(host_ip, token), metrics)
 
-print("Grid movement complete, lock released")
+    try:
+        run_grid(eva, Kinematics(eva, KINEMATICS_BACKEND), my_test_grid, on_position=lambda: metrics.count('picks'),
+                 transit_policy=TRANSIT_POLICY)
+    finally:
+        metrics.export()
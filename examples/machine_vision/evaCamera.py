@@ -1,4 +1,9 @@
+import os
+import sys
 from automata import Eva
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from evaKinematics import Kinematics
+from evaLockLease import LockLease, lock_session
 
 
 XYPosition = (float, float)
@@ -16,8 +21,13 @@ class EvaCamera:
     position relative to the machine vision camera and move Eva's end
     effector to that object.
     """
-    def __init__(self, eva: Eva, camera_relative_position: XYZPosition, camera_to_object_distance: float):
+    def __init__(self, eva: Eva, camera_relative_position: XYZPosition, camera_to_object_distance: float,
+                 kinematics: Kinematics = None):
+        """
+        kinematics selects the IK backend, by default Eva itself.
+        """
         self.__eva = eva
+        self.__kinematics = kinematics if kinematics is not None else Kinematics(eva)
         self.__eva_offset_position_x = camera_relative_position[0] 
         self.__eva_offset_position_y = camera_relative_position[1]
         self.__eva_offset_position_z = camera_relative_position[2] - camera_to_object_distance
@@ -40,8 +50,11 @@ class EvaCamera:
         item_position    =   {'x': eva_relative_x, 'y': eva_relative_y, 'z': eva_relative_z}
 
         print(f'moving to item position {item_position}')
-        with self.__eva.lock():
-            to_item_joint_angles = self.__eva.calc_inverse_kinematics(POSE_GUESS, item_position, DEFAULT_END_EFFECTOR_ORIENTATION)
+        with lock_session(self.__eva):
+            to_item_joint_angles = self.__kinematics.calc_inverse_kinematics(POSE_GUESS, item_position, DEFAULT_END_EFFECTOR_ORIENTATION)
+            # A failed solve must not reach the arm
+            if 'success' not in to_item_joint_angles['ik']['result']:
+                raise Exception(f'IK failed for item position {item_position}: check the end effector orientation')
             self.__eva.control_go_to(to_item_joint_angles['ik']['joints'])
         
         print("in item position")        
@@ -61,7 +74,7 @@ class EvaCamera:
         usecase you may want to place in a bin.
         """
         print("moving home")
-        with self.__eva.lock():
+        with lock_session(self.__eva):
             self.__eva.control_go_to(POSE_HOME)      
 
         print("in home position")          
@@ -80,6 +93,8 @@ if __name__ == "__main__":
 
     # initialize EvaCamera with a working Eva and the camera positional information
     eva = Eva("<IP_here>", "<token_here>")
+    # the moves below reuse a single lock acquisition, released after 5 s without requests
+    lease = LockLease(eva, idle_timeout=5.0)
     camera_position = (1.2, 2.3, 3.4)
     camera_to_item_distance = 2.2
     ec = EvaCamera(eva, camera_position, camera_to_item_distance)
@@ -93,3 +108,4 @@ if __name__ == "__main__":
 
     # move eva home
     ec.move_home()
+    lease.release()
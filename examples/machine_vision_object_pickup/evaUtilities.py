@@ -1,14 +1,9 @@
-import math
-import operator
+import os
+import sys
+import time
 import numpy as np
-
-
-def _convert_to_float(fl):
-    """ This method converts ONLY the numeric values of a string into floats """
-    try:
-        return float(fl)
-    except (ValueError, TypeError):
-        return fl
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from poseMath import head_down_orientation, quaternion_to_dict
 
 
 def _wrap_to_pi(angle):
@@ -20,20 +15,9 @@ def _wrap_to_pi(angle):
         return ang
 
 
-def _quaternion_multiply(quat1, quat0):
-    """ This method performs a standard quaternion multiplication
-    quat0 : [qR0, qV0], with qR0 being the real part of the quaternion
-    quat1 : [qR1, qV1], with qR1 being the real part of the quaternion """
-    w0, x0, y0, z0 = quat0
-    w1, x1, y1, z1 = quat1
-    return np.array([-x1 * x0 - y1 * y0 - z1 * z0 + w1 * w0,
-                     x1 * w0 + y1 * z0 - z1 * y0 + w1 * x0,
-                     -x1 * z0 + y1 * w0 + z1 * x0 + w1 * y0,
-                     x1 * y0 - y1 * x0 + z1 * w0 + w1 * z0], dtype=np.float64)
-
-
 def _solve_fk(eva, joints):
     """ This method solves the forward kinematics problem and extract the results directly as an array
+    eva : Eva, or a Kinematics to select the FK backend
     joints : joint angles in [rad]
     pos : cartesian position, with respect to robot's origin [m]
     orient : orientation quaternion of the end effector """
@@ -45,101 +29,201 @@ def _solve_fk(eva, joints):
     return pos, orient
 
 
-def solve_ik_head_down(eva, guess, theta, xyz_absolute):
+def solve_ik_head_down(eva, guess, theta, xyz_absolute, stats=None):
     """ This method solves the inverse kinematics problem for the special case of the end-effector
     pointing downwards, perpendicular to the ground.
+    eva : Eva, or a Kinematics to select the IK backend
     guess : is the IK guess, a 1x6 array of joint angles in [rad]
     theta : angular rotation of axis 6 [deg]
-    xyz_absolute : cartesian position, with respect to robot's origin [m] """
+    xyz_absolute : cartesian position, with respect to robot's origin [m]
+    stats : optional IkStats collecting the latency and iterations of the call """
     pos = [xyz_absolute[0], xyz_absolute[1], xyz_absolute[2]]  # [m]
     pos_json = {'x': (pos[0]), 'y': (pos[1]), 'z': (pos[2])}  # [m]
-    orient_rel = [math.cos(np.deg2rad(theta) / 2), 0, 0, math.sin(np.deg2rad(theta) / 2)]
-    orient_abs = _quaternion_multiply([0, 0, 1, 0], orient_rel)
-    orient_json = {'w': (orient_abs[0]), 'x': (orient_abs[1]), 'y': (orient_abs[2]), 'z': (orient_abs[3])}
+    orient_json = quaternion_to_dict(head_down_orientation(theta))
     # Compute IK
+    start = time.perf_counter()
     result_ik = eva.calc_inverse_kinematics(guess, pos_json, orient_json)
+    if stats is not None:
+        stats.record(time.perf_counter() - start, result_ik)
     success_ik = result_ik['ik']['result']
     joints_ik = result_ik['ik']['joints']
     return success_ik, joints_ik
 
 
-def read_tcp_ip(sock, objects):
-    """ This method reads and decodes the string sent from the camera """
-    result = sock.recv(4000)
-    string_read = result.decode('utf-8')
-    string_split = string_read.split(",")
-    camera_string_raw = list(string_split)
-    passed = False
-    camera_string = ['']
-    if len(camera_string_raw) is not 0:
-        if camera_string_raw[0] == 'start' and camera_string_raw[19] == 'end' and len(camera_string_raw) == 20:
-            camera_string_raw = [_convert_to_float(fl) for fl in camera_string_raw]
-            passes = [camera_string_raw[6], camera_string_raw[12], camera_string_raw[18]]
-            scores = [camera_string_raw[5], camera_string_raw[11], camera_string_raw[17]]
-            passed_score = [passes[0] * scores[0], passes[1] * scores[1], passes[2] * scores[2]]
-            max_index, max_value = max(enumerate(passed_score), key=operator.itemgetter(1))
-            select_obj = objects[max_index]
-            if max_value > 0:
-                passed = True
-                # Extract the best matching object from the string
-                camera_string = _extract_camera_serial(objects, select_obj, camera_string_raw)
+class CameraStream:
+    """ This class frames the TCP feed of the camera into 'start,...,end' messages. The data is received into a
+    reusable buffer with recv_into(), so that messages split across reads or coalesced into a single read are
+    all recovered, and each complete message is yielded as a memoryview of the buffer, without copies. A message
+    whose 'end' never comes is dropped once it fills max_buffer_size bytes, and the stream resyncs on the next
+    'start' """
+    START = b'start'
+    END = b',end'
+
+    def __init__(self, sock, buffer_size=65536, max_buffer_size=1 << 20):
+        self.sock = sock
+        self.max_buffer_size = max(buffer_size, max_buffer_size)
+        self.dropped = 0  # messages dropped without their 'end' marker
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._begin = 0  # first byte not yet framed
+        self._end = 0  # end of the received data
+
+    def recv_view(self):
+        """ This method returns the free part of the buffer, to receive into. Pending data is moved to the
+        front of the buffer first, and the buffer is doubled if a partial message fills all of it, up to
+        max_buffer_size """
+        if self._begin > 0:
+            self._keep(self._begin)
+        if self._end == len(self._buffer) and self._end >= self.max_buffer_size:
+            self._resync()
+        if self._end == len(self._buffer):
+            buffer = bytearray(min(2 * len(self._buffer), self.max_buffer_size))
+            buffer[:self._end] = self._view[:self._end]
+            self._buffer, self._view = buffer, memoryview(buffer)
+        return self._view[self._end:]
+
+    def _keep(self, begin):
+        """ This method moves the data from begin to the front of the buffer, dropping what precedes it """
+        pending = self._end - begin
+        self._buffer[:pending] = self._view[begin:self._end]
+        self._begin, self._end = 0, pending
+
+    def _resync(self):
+        """ This method drops the partial message filling the buffer, whose 'end' marker was lost, up to the next
+        'start' marker, or up to a possible partial 'start' marker at the end of the data """
+        start = self._buffer.find(self.START, 1, self._end)
+        self._keep(start if start > 0 else self._end - len(self.START) + 1)
+        self.dropped += 1
+        print('Camera message without end marker dropped after {} bytes'.format(self.max_buffer_size))
+
+    def feed(self, nbytes):
+        """ This method accounts for nbytes received into recv_view() and yields every complete message.
+        The yielded memoryviews are only valid until the next call to recv_view() """
+        self._end += nbytes
+        while True:
+            start = self._buffer.find(self.START, self._begin, self._end)
+            if start < 0:
+                # Keep a possible partial 'start' marker, discard anything else
+                self._begin = max(self._begin, self._end - len(self.START) + 1)
+                return
+            end = self._buffer.find(self.END, start, self._end)
+            if end < 0:
+                self._begin = start
+                return
+            self._begin = end + len(self.END)
+            yield self._view[start:self._begin]
+
+    def frames(self):
+        """ This generator reads from the socket and yields every complete message, until the camera disconnects """
+        while True:
+            nbytes = self.sock.recv_into(self.recv_view())
+            if nbytes == 0:
+                return
+            yield from self.feed(nbytes)
+
+
+def read_tcp_stream(camera_stream, objects):
+    """ This generator reads and decodes every message sent from the camera, yielding (passed, camera_string) """
+    for frame in camera_stream.frames():
+        yield decode_camera_frame(frame, objects)
+
+
+# Schema of the camera messages: 'start', then one record of these fields per object model, then 'end'
+DETECTION_DTYPE = np.dtype([('name', 'U16'), ('x', np.float64), ('y', np.float64), ('angle', np.float64),
+                            ('score', np.float64), ('pass', np.float64)])
+
+
+def parse_camera_frame(frame):
+    """ This method parses a 'start,...,end' message from the camera, with any number of objects, into a structured
+    array of DETECTION_DTYPE, in one pass over its fields. Malformed messages give an empty array """
+    fields = bytes(frame).split(b',')
+    n_fields = len(DETECTION_DTYPE.names)
+    if len(fields) < 2 or fields[0] != b'start' or fields[-1] != b'end' or (len(fields) - 2) % n_fields != 0:
+        return np.zeros(0, dtype=DETECTION_DTYPE)
+    if len(fields) == 2:
+        return np.zeros(0, dtype=DETECTION_DTYPE)
+    records = np.array(fields[1:-1], dtype=np.bytes_).reshape(-1, n_fields)
+    detections = np.empty(len(records), dtype=DETECTION_DTYPE)
+    try:
+        detections['name'] = np.char.decode(records[:, 0], 'utf-8')
+        values = records[:, 1:].astype(np.float64)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return np.zeros(0, dtype=DETECTION_DTYPE)
+    for index, name in enumerate(DETECTION_DTYPE.names[1:]):
+        detections[name] = values[:, index]
+    return detections
+
+
+def select_detections(detections, objects, best=True):
+    """ This method selects the detections that passed, of the objects in the list, with a positive score.
+    best : return only the best scoring one, as an array of 0 or 1 detections, otherwise all of them from the best """
+    passed_score = detections['pass'] * detections['score']
+    passed = np.flatnonzero((passed_score > 0) & np.isin(detections['name'], objects))
+    if best:
+        return detections[passed[np.argmax(passed_score[passed])]][np.newaxis] if len(passed) else detections[:0]
+    return detections[passed[np.argsort(-passed_score[passed], kind='stable')]]
+
+
+def decode_camera_frame(frame, objects):
+    """ This method decodes a single 'start,...,end' message from the camera into the best matching object """
+    best = select_detections(parse_camera_frame(frame), objects)
+    if len(best) == 0:
+        return False, ['']
     # String format = ['start', 'object_name', float x_mm, float y_mm, float angle]
-    return passed, camera_string
-
-
-def _extract_camera_serial(objects, index, camera_string_raw):
-    """ This method extracts only the best matching object data from the entire string """
-    camera_string = ['', 0, 0, 0, 0]
-    if index not in objects:
-        print('Wrong object in the list')
-    elif index is 'C':
-        camera_string[0] = 'start'
-        camera_string[1] = camera_string_raw[1]
-        camera_string[2] = camera_string_raw[2]
-        camera_string[3] = camera_string_raw[3]
-        camera_string[4] = camera_string_raw[4]
-    elif index is 'M':
-        camera_string[0] = 'start'
-        camera_string[1] = camera_string_raw[7]
-        camera_string[2] = camera_string_raw[8]
-        camera_string[3] = camera_string_raw[9]
-        camera_string[4] = camera_string_raw[10]
-    elif index is 'R':
-        camera_string[0] = 'start'
-        camera_string[1] = camera_string_raw[13]
-        camera_string[2] = camera_string_raw[14]
-        camera_string[3] = camera_string_raw[15]
-        camera_string[4] = camera_string_raw[16]
-    return camera_string
+    detection = best[0]
+    return True, ['start', str(detection['name']), float(detection['x']), float(detection['y']),
+                  float(detection['angle'])]
+
+
+class CameraTransform:
+    """ This class maps object positions from the camera frame to Eva's frame. It is built once at start-up:
+    the calibration board origin is computed with a single forward kinematics call and, together with the fixed
+    rotation of the camera, stored in a 3x3 homogeneous matrix of the xy plane """
+    def __init__(self, eva, cal_zero, surf_height=0.0, ee_length=0.0, ang_cam=180):
+        """ eva : Eva, or a Kinematics to select the FK backend
+        cal_zero : joints @ (0,0) of calibration board [rad]
+        ang_cam : rotation from the camera frame to Eva's frame [deg] """
+        # Compute absolute object position of calibration board origin in Eva's frame:
+        pos_cal = eva.calc_forward_kinematics(cal_zero)['position']
+        self.origin = np.array([pos_cal['x'], pos_cal['y'], pos_cal['z']])  # [m]
+        # Convention: start from camera frame and rotate of ang [deg] to get to Eva's frame
+        cos_cam, sin_cam = np.cos(np.deg2rad(ang_cam)), np.sin(np.deg2rad(ang_cam))
+        self.matrix = np.array([[cos_cam, sin_cam, self.origin[0]],
+                                [-sin_cam, cos_cam, self.origin[1]],
+                                [0.0, 0.0, 1.0]])
+        self.surf = surf_height
+        self.ee = ee_length
+
+    def to_eva(self, xy_cam, obj_height=0.0):
+        """ This method returns the absolute position [m] of one or more objects in Eva's frame
+        xy_cam : object position in camera frame, (2,) or (N, 2) array [mm]
+        obj_height : object thickness, scalar or (N,) array [m]
+        Returns a (3,) or (N, 3) array """
+        xy_cam = np.asarray(xy_cam, dtype=np.float64)
+        xy = 0.001 * np.atleast_2d(xy_cam)  # transform X, Y values from [mm] into [m]
+        xyz = np.empty((xy.shape[0], 3))
+        xyz[:, :2] = xy @ self.matrix[:2, :2].T + self.matrix[:2, 2]
+        # Compute absolute value of Z
+        xyz[:, 2] = np.abs(obj_height) + self.surf + abs(self.ee)
+        return xyz[0] if xy_cam.ndim == 1 else xyz
 
 
 class EvaVision:
     """ This class performs the machine vision operations in order to obtain the object position in Eva's frame """
-    def __init__(self, eva, string, cal_zero, obj_height=0.0, surf_height=0.0, ee_length=0.0):
+    def __init__(self, eva, string, cal_zero, obj_height=0.0, surf_height=0.0, ee_length=0.0, transform=None):
         self.eva = eva
         self.string = string
         self.cal = cal_zero
         self.obj = obj_height
         self.surf = surf_height
         self.ee = ee_length
+        # Pass a CameraTransform built once to avoid a forward kinematics request per object
+        self.transform = transform
 
     def locate_object(self):
         print('Pattern identified is: ', self.string[1])
-        # Relative object position in camera frame:
-        x_obj_rel_cam = 0.001*self.string[2]  # transform X value from [mm] into [m]
-        y_obj_rel_cam = 0.001*self.string[3]  # transform Y value from [mm] into [m]
-        # Compute relative object position in Eva's frame:
-        # Need to known Eva's frame rotation wrt to camera frame
-        # Convention: start from camera frame and rotate of ang [deg] to get to Eva's frame
-        ang_cam = 180  # [deg]
-        x_obj_rel = np.cos(np.deg2rad(ang_cam)) * x_obj_rel_cam + np.sin(np.deg2rad(ang_cam)) * y_obj_rel_cam  # [m]
-        y_obj_rel = -np.sin(np.deg2rad(ang_cam)) * x_obj_rel_cam + np.cos(np.deg2rad(ang_cam)) * y_obj_rel_cam  # [m]
-        # Compute absolute object position of calibration board origin in Eva's frame:
-        pos_cal = self.eva.calc_forward_kinematics(self.cal)['position']
-        # Compute absolute object position by summing the calibration board origin to the relative object position
-        x_obj_abs = x_obj_rel + pos_cal['x']  # [m]
-        y_obj_abs = y_obj_rel + pos_cal['y']  # [m]
-        # Compute absolute value of Z
-        z_obj_abs = abs(self.obj) + self.surf + abs(self.ee)
-        pos_abs = [x_obj_abs, y_obj_abs, z_obj_abs]
-        return pos_abs
+        if self.transform is None:
+            self.transform = CameraTransform(self.eva, self.cal, self.surf, self.ee)
+        # Relative object position in camera frame [mm], mapped into Eva's frame [m]
+        pos_abs = self.transform.to_eva([self.string[2], self.string[3]], self.obj)
+        return pos_abs.tolist()
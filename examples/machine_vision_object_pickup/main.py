@@ -1,9 +1,44 @@
+import os
+import sys
 import socket
+import asyncio
 from automata import Eva
-from evaUtilities import *
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from ikStats import IkStats
+from evaUtilities import CameraStream
+from toolpathTemplate import ToolpathTemplate
+from evaMetrics import Metrics, instrument
+from evaLockLease import LockLease
+from cycleTime import CycleTimeEstimator
+from pickupPipeline import PickupPlanner, run_serial, run_async
 from config.config_manager import load_use_case_config
 
 
+def build_toolpath(joints_home, joints_drop):
+    """ This method builds the pick and place toolpath. It is a template: metadata and timeline are built once,
+    only the hover and pickup waypoints change between pickups """
+    return ToolpathTemplate(
+        metadata={
+            "default_velocity": 1,
+            "analog_modes": {"i0": "voltage", "i1": "voltage", "o0": "voltage", "o1": "voltage"}
+        },
+        waypoint_names=['home', 'hover', 'pickup', 'drop'],
+        timeline=[
+            {"type": "home", "waypoint_id": 0},
+            {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 1},
+            {"type": "output-set", "io": {"location": "base", "type": "digital", "index": 0},
+             "value": True},
+            {"type": "trajectory", "trajectory": "linear", "waypoint_id": 2},
+            {"type": "wait", "condition": {"type": "time", "duration": 500}},
+            {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 1},
+            {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 3},
+            {"type": "output-set", "io": {"location": "base", "type": "digital", "index": 0},
+             "value": False},
+            {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 0},
+        ]
+    ).set_joints(home=joints_home, drop=joints_drop)
+
+
 if __name__ == "__main__":
     # Load config parameters
     config = load_use_case_config()
@@ -11,7 +46,12 @@ if __name__ == "__main__":
     # Connection to robot
     host = config['EVA']['comms']['host']
     token = config['EVA']['comms']['token']
-    eva = Eva(host, token)
+    # Per-phase timings of the requests to Eva, exported periodically when enabled
+    metrics = Metrics.from_config(config)
+    eva = instrument(Eva(host, token), metrics)
+    # Eva's lock is acquired at the first request, renewed while objects keep coming and released after
+    # idle_timeout without requests, so that Eva is not held while the camera sees nothing
+    lease = LockLease(eva, config['lock']['idle_timeout'], config['lock']['renew_period'])
 
     # Connection to camera
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -21,71 +61,40 @@ if __name__ == "__main__":
 
     # Use-case parameters to be modified in YAML file ~/config/use_case_config.yaml
     objects = config['objects']['names']  # object names [m]
-    obj_heights = config['objects']['heights']  # object thicknesses [m]
-    ee_length = config['EVA']['end_effector']['length']  # length of tool [m]
-    hover_height = config['EVA']['hover_height']  # elevation of idle z axis wrt to the object [m]
-    surf_height = config['EVA']['surface_height']  # elevation of the pickup surface wrt to the robot [m, signed]
-    joints_cal_zero = config['waypoints']['joints_cal_zero']  # joints @ (0,0) of calibration board
-    joints_guess = config['waypoints']['joints_guess']  # joints guess for pickup/hover position
     joints_home = config['waypoints']['joints_home']  # joints guess for home position
     joints_drop = config['waypoints']['joints_drop']  # joints guess for drop position
+    stats_every = config['ik']['stats_every']  # print IK statistics every N pickups
+    pipeline_mode = config['pipeline']['mode']  # 'serial' or 'async'
+    queue_size = config['pipeline']['queue_size']  # detections buffered between camera and planning
 
-    with eva.lock():
-        while True:
-            passed, cam_string = read_tcp_ip(sock, objects)
-
-            if passed is True and len(cam_string) == 5 and cam_string[0] is 'start':
-                obj_name = cam_string[1]
-                obj_angle = cam_string[4]
-                evaVision = EvaVision(eva, cam_string, joints_cal_zero, obj_heights[obj_name], surf_height, ee_length)
-                xyz = evaVision.locate_object()  # object position in Eva's frame [m]
-                xyz_hover = xyz
-                xyz_hover[2] = xyz[2] + abs(hover_height)  # add hover height to object position's Z [m]
+    # Toolpath template: metadata and timeline are built once, only the waypoints change between pickups
+    toolpath_machine_vision = build_toolpath(joints_home, joints_drop)
 
-                # Compute IK for pickup and hover - special case with head down solution
-                success_IK_pickup, joints_pickup = solve_ik_head_down(eva, joints_guess, obj_angle, xyz)
-                success_IK_hover, joints_hover = solve_ik_head_down(eva, joints_guess, obj_angle, xyz_hover)
+    ik_stats = IkStats()
+    cycle_time = CycleTimeEstimator.from_config(config)
+    pickups = 0
 
-                # Verify IK success
-                if 'success' in success_IK_hover and 'success' in success_IK_pickup:
-                    perform_move = True
-                    message = 'Successful IK'
-                    print(message)
-                else:
-                    perform_move = False
-                    message = 'Failed IK. Position not reachable'
-                    print(message)
+    def on_pickup():
+        global pickups
+        pickups += 1
+        metrics.count('picks')
+        if stats_every and pickups % stats_every == 0:
+            print('IK requests - ' + str(ik_stats))
+            print('Camera detections - ' + str(planner.recent))
+            print('Estimated toolpath time: {:.2f} s'.format(cycle_time.toolpath(toolpath_machine_vision.toolpath())))
 
-                if perform_move is True:
+    camera_stream = CameraStream(sock)
 
-                    toolpath_machine_vision = {
-                        "metadata": {
-                            "default_velocity": 1,
-                            "next_label_id": 5,
-                            "analog_modes": {"i0": "voltage", "i1": "voltage", "o0": "voltage", "o1": "voltage"}
-                        },
-                        "waypoints": [
-                            {"label_id": 1, "joints": joints_home},
-                            {"label_id": 2, "joints": joints_hover},
-                            {"label_id": 3, "joints": joints_pickup},
-                            {"label_id": 4, "joints": joints_drop},
-                        ],
-                        "timeline": [
-                            {"type": "home", "waypoint_id": 0},
-                            {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 1},
-                            {"type": "output-set", "io": {"location": "base", "type": "digital", "index": 0},
-                             "value": True},
-                            {"type": "trajectory", "trajectory": "linear", "waypoint_id": 2},
-                            {"type": "wait", "condition": {"type": "time", "duration": 500}},
-                            {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 1},
-                            {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 3},
-                            {"type": "output-set", "io": {"location": "base", "type": "digital", "index": 0},
-                             "value": False},
-                            {"type": "trajectory", "trajectory": "joint_space", "waypoint_id": 0},
-                        ]
-                    }
-                    eva.control_wait_for_ready()
-                    eva.toolpaths_use(toolpath_machine_vision)
-                    eva.control_run()
+    # The last metrics are exported on exit, i.e. on Ctrl+C or on an error
+    try:
+        with lease:
+            # The camera to Eva transform is computed once, here, for all the detected objects
+            planner = PickupPlanner(eva, config, ik_stats)
+            if pipeline_mode == 'async':
+                # Camera reads and planning of the next object overlap with the motion of the current one
+                asyncio.run(run_async(eva, camera_stream, objects, planner, toolpath_machine_vision, queue_size,
+                                      on_pickup))
             else:
-                print('No object correctly recognized')
+                run_serial(eva, camera_stream, objects, planner, toolpath_machine_vision, on_pickup)
+    finally:
+        metrics.export()
@@ -0,0 +1,147 @@
+import os
+import sys
+import asyncio
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+from evaKinematics import Kinematics
+from evaUtilities import CameraTransform, solve_ik_head_down, read_tcp_stream, decode_camera_frame
+from evaLockLease import lock_session
+from recentPositions import RecentPositions
+
+
+class PickupPlanner:
+    """ This class computes the joints needed to pick up a detected object: it locates the object in Eva's frame
+    and solves the head-down IK of the pickup and hover points, seeding them when warm start is enabled. Objects
+    close to one picked up or rejected shortly before are skipped, as the camera keeps reporting them """
+    def __init__(self, eva, config, stats=None):
+        self.eva = eva
+        self.stats = stats
+        # FK/IK backend: 'remote' (Eva), 'local' (NumPy model of the arm) or 'checked' (local, cross-checked with Eva)
+        self.kinematics = Kinematics.from_config(eva, config)
+        self.obj_heights = config['objects']['heights']  # object thicknesses [m]
+        self.hover_height = config['EVA']['hover_height']  # elevation of idle z axis wrt to the object [m]
+        self.joints_guess = config['waypoints']['joints_guess']  # joints guess for pickup/hover position
+        self.warm_start = config['ik']['warm_start']  # seed the IK with the last successful pickup
+        self.joints_seed = self.joints_guess  # IK guess for the next pickup
+        self.recent = RecentPositions.from_config(config)  # positions recently picked up or rejected
+        # Camera to Eva transform, computed once from the joints @ (0,0) of calibration board
+        with self.kinematics.lock():
+            self.transform = CameraTransform(self.kinematics, config['waypoints']['joints_cal_zero'],
+                                             config['EVA']['surface_height'], config['EVA']['end_effector']['length'])
+
+    def plan(self, cam_string):
+        """ This method returns the (joints_hover, joints_pickup) of the object described by cam_string,
+        or None if the object is not reachable or was picked up or rejected within the duplicates time window """
+        obj_name = cam_string[1]
+        obj_angle = cam_string[4]
+        print('Pattern identified is: ', obj_name)
+        xyz = self.transform.to_eva(cam_string[2:4], self.obj_heights[obj_name]).tolist()  # position in Eva's frame [m]
+        if self.recent.check(xyz):
+            print('Object already picked up or rejected, skipped')
+            return None
+        xyz_hover = list(xyz)
+        xyz_hover[2] = xyz[2] + abs(self.hover_height)  # add hover height to object position's Z [m]
+
+        # Compute IK for pickup and hover - special case with head down solution
+        # With warm start, the pickup is seeded with the last successful pickup and the hover with the pickup
+        with self.kinematics.lock():
+            success_IK_pickup, joints_pickup = solve_ik_head_down(self.kinematics, self.joints_seed, obj_angle, xyz,
+                                                                  self.stats)
+            warm_hover = self.warm_start and 'success' in success_IK_pickup
+            joints_seed_hover = joints_pickup if warm_hover else self.joints_guess
+            success_IK_hover, joints_hover = solve_ik_head_down(self.kinematics, joints_seed_hover, obj_angle,
+                                                                xyz_hover, self.stats)
+
+        # Verify IK success
+        if 'success' in success_IK_hover and 'success' in success_IK_pickup:
+            print('Successful IK')
+            if self.warm_start:
+                self.joints_seed = joints_pickup
+            self.recent.add(xyz, 'picked')
+            return joints_hover, joints_pickup
+        print('Failed IK. Position not reachable')
+        self.recent.add(xyz, 'rejected')
+        return None
+
+
+def _is_valid_detection(passed, cam_string):
+    return passed is True and len(cam_string) == 5 and cam_string[0] == 'start'
+
+
+def execute_pickup(eva, toolpath, joints):
+    """ This method runs the pick and place toolpath for the (joints_hover, joints_pickup) of an object """
+    joints_hover, joints_pickup = joints
+    # Only the hover and pickup waypoints change; the upload is skipped if the toolpath is unchanged
+    toolpath.set_joints(hover=joints_hover, pickup=joints_pickup)
+    with lock_session(eva):
+        eva.control_wait_for_ready()
+        toolpath.use(eva)
+        eva.control_run()
+
+
+def run_serial(eva, camera_stream, objects, planner, toolpath, on_pickup=None):
+    """ This method reads a detection, plans it and runs it, one object after the other """
+    for passed, cam_string in read_tcp_stream(camera_stream, objects):
+        if not _is_valid_detection(passed, cam_string):
+            print('No object correctly recognized')
+            continue
+        joints = planner.plan(cam_string)
+        if joints is not None:
+            execute_pickup(eva, toolpath, joints)
+            if on_pickup is not None:
+                on_pickup()
+
+
+async def run_async(eva, camera_stream, objects, planner, toolpath, queue_size=2, on_pickup=None):
+    """ This coroutine overlaps camera reads, planning and robot motion in three stages connected by bounded queues:
+    the next object is located and its IK solved while the current pick is executing, so that Eva always has its
+    next job ready when it becomes idle. When the detections queue is full the oldest detection is dropped, as the
+    camera keeps reporting the objects still in view. The pipeline shuts down cleanly when the camera disconnects:
+    the pending job is executed and the stages exit in order """
+    loop = asyncio.get_running_loop()
+    detections = asyncio.Queue(maxsize=queue_size)
+    jobs = asyncio.Queue(maxsize=1)
+    camera_stream.sock.setblocking(False)
+
+    async def read_camera():
+        while True:
+            nbytes = await loop.sock_recv_into(camera_stream.sock, camera_stream.recv_view())
+            if nbytes == 0:
+                break
+            for frame in camera_stream.feed(nbytes):
+                passed, cam_string = decode_camera_frame(frame, objects)
+                if not _is_valid_detection(passed, cam_string):
+                    print('No object correctly recognized')
+                    continue
+                if detections.full():
+                    detections.get_nowait()
+                detections.put_nowait(cam_string)
+        # Camera disconnected: tell the next stage to finish
+        await detections.put(None)
+
+    async def plan():
+        while True:
+            cam_string = await detections.get()
+            if cam_string is None:
+                break
+            # IK requests are blocking HTTP calls: run them in a worker thread
+            joints = await loop.run_in_executor(None, planner.plan, cam_string)
+            if joints is not None:
+                await jobs.put(joints)
+        await jobs.put(None)
+
+    async def execute():
+        while True:
+            joints = await jobs.get()
+            if joints is None:
+                return
+            await loop.run_in_executor(None, execute_pickup, eva, toolpath, joints)
+            if on_pickup is not None:
+                on_pickup()
+
+    stages = [asyncio.ensure_future(stage()) for stage in (read_camera, plan, execute)]
+    try:
+        await asyncio.gather(*stages)
+    finally:
+        # On errors or interruption, stop the remaining stages
+        for stage in stages:
+            stage.cancel()
@@ -0,0 +1,79 @@
+import time
+import math
+import threading
+from collections import deque
+
+
+class RecentPositions:
+    """ This class remembers the positions, in Eva's frame, of the objects recently picked up or rejected (i.e.
+    failed IK), so that the detections of the same objects in the following camera frames are skipped before any IK
+    request or toolpath upload. The positions are stored in a spatial hash of the xy plane with cells of the size of
+    the suppression radius: a detection is only compared with the positions of its own cell and of the 8 neighbouring
+    ones, and positions older than the time window are evicted in insertion order, so that both checks and updates
+    take constant time """
+    def __init__(self, radius=0.01, window=2.0, clock=time.monotonic):
+        """ radius : detections closer than this to a recent position are duplicates [m]
+        window : time during which a position is remembered [s], 0 to disable the suppression """
+        self.radius = radius
+        self.window = window
+        self.clock = clock
+        self._cells = {}  # cell -> deque of (x, y, time, reason), oldest first
+        self._entries = deque()  # (time, cell) of every stored position, oldest first
+        self.suppressed = {'picked': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """ This method builds the filter from the optional 'duplicates' tag of the use-case configuration """
+        config = config.get('duplicates', {})
+        return cls(config.get('radius', 0.01), config.get('window', 2.0))
+
+    @property
+    def enabled(self):
+        return self.window > 0 and self.radius > 0
+
+    def _cell(self, x, y):
+        return math.floor(x / self.radius), math.floor(y / self.radius)
+
+    def _evict(self, now):
+        while self._entries and now - self._entries[0][0] > self.window:
+            _, cell = self._entries.popleft()
+            positions = self._cells[cell]
+            positions.popleft()
+            if not positions:
+                del self._cells[cell]
+
+    def add(self, xyz, reason='picked'):
+        """ This method remembers the position xyz [m] of an object picked up or rejected (reason) """
+        if not self.enabled:
+            return
+        with self._lock:
+            now = self.clock()
+            self._evict(now)
+            cell = self._cell(xyz[0], xyz[1])
+            self._cells.setdefault(cell, deque()).append((xyz[0], xyz[1], now, reason))
+            self._entries.append((now, cell))
+
+    def check(self, xyz):
+        """ This method returns True, and counts the duplicate, if xyz [m] is within the radius of a position
+        picked up or rejected within the time window """
+        if not self.enabled:
+            return False
+        with self._lock:
+            self._evict(self.clock())
+            cell_x, cell_y = self._cell(xyz[0], xyz[1])
+            radius_sq = self.radius * self.radius
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for x, y, _, reason in self._cells.get((cell_x + dx, cell_y + dy), ()):
+                        if (x - xyz[0]) ** 2 + (y - xyz[1]) ** 2 <= radius_sq:
+                            self.suppressed[reason] += 1
+                            return True
+            return False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return 'duplicates suppressed: {} picked, {} rejected, {} positions remembered'.format(
+            self.suppressed['picked'], self.suppressed['rejected'], len(self))